@@ -0,0 +1,141 @@
+from typing import Callable, Optional, Tuple
+import glob
+import math
+import os
+
+import torch
+import torch.nn.functional as F
+from torch.utils.data import get_worker_info
+
+from pcm import PCMFrame
+from resample import resample
+
+__all__ = ["Augment", "load_noise"]
+
+"""
+Random training augmentation of whole padded batches (batch, channels, time):
+background noise mixed in at a random SNR, gain, time shift and speed
+perturbation. Every transform draws one random value per clip and is applied
+to the batch at once; shift and speed share a single interpolation.
+
+    augment = Augment(8000, noise=load_noise("data/hal_keywords/_background_noise_", 8000))
+    waveforms = augment(waveforms)
+    DataLoader(..., collate_fn=augment.collate(collate_fn))  # in the workers
+
+HAL_KW(augment=True) does the latter for its training loader.
+"""
+
+
+def load_noise(path: str, sample_rate: int) -> Optional[torch.Tensor]:
+    """all WAV files under path, mono at sample_rate and concatenated; None if there are none"""
+    noise = []
+    for wav in sorted(glob.glob(os.path.join(path, "*.wav"))):
+        frame = PCMFrame.from_wav(wav)
+        noise.append(resample(frame.to_tensor().mean(dim=0), frame.sample_rate, sample_rate))
+    return torch.cat(noise) if noise else None
+
+
+class Augment:
+    """
+    sample_rate: of the batches
+    noise: (n,) background audio to cut random segments from (see load_noise); None for white noise
+    snr_db, gain_db, speed: ranges random values are drawn from uniformly, per clip
+    shift: largest time shift either way, in seconds
+    p_noise, p_speed: fraction of clips that get noise / speed perturbation
+    seed: of the main process; each DataLoader worker seeds from its own worker seed
+    """
+    def __init__(
+            self,
+            sample_rate: int,
+            noise: Optional[torch.Tensor] = None,
+            snr_db: Tuple[float, float] = (0., 20.),
+            p_noise: float = .8,
+            gain_db: Tuple[float, float] = (-6., 6.),
+            shift: float = .1,
+            speed: Tuple[float, float] = (.9, 1.1),
+            p_speed: float = .5,
+            seed: int = 0,
+        ):
+        self.sample_rate = sample_rate
+        self.noise = noise
+        self.snr_db = snr_db
+        self.p_noise = p_noise
+        self.gain_db = gain_db
+        self.shift = shift
+        self.speed = speed
+        self.p_speed = p_speed
+        self.seed = seed
+        self._generator: Optional[torch.Generator] = None
+        self._generator_seed: Optional[int] = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_generator"] = None
+        return state
+
+    @property
+    def generator(self) -> torch.Generator:
+        # a different stream in every worker (and every epoch: workers are restarted with new seeds)
+        info = get_worker_info()
+        seed = info.seed if info is not None else self.seed
+        if self._generator is None or self._generator_seed != seed:
+            self._generator = torch.Generator().manual_seed(seed)
+            self._generator_seed = seed
+        return self._generator
+
+    def _uniform(self, low: float, high: float, n: int) -> torch.Tensor:
+        return low + (high - low) * torch.rand(n, generator=self.generator)
+
+    def warp(self, waveforms: torch.Tensor) -> torch.Tensor:
+        """every clip shifted and sped up / slowed down by its own random amount, in one interpolation"""
+        batch, channels, time = waveforms.shape
+        shift = self._uniform(-self.shift, self.shift, batch) * self.sample_rate
+        speed = self._uniform(*self.speed, batch)
+        speed = torch.where(torch.rand(batch, generator=self.generator) < self.p_speed, speed, torch.ones(batch))
+        # output sample t reads input position (t - shift) * speed; outside the clip reads zeros
+        position = (torch.arange(time, dtype=torch.float32)[None] - shift[:, None]) * speed[:, None]
+        grid = torch.zeros(batch, 1, time, 2)
+        grid[..., 0] = (2 * position / max(time - 1, 1) - 1)[:, None]
+        out = F.grid_sample(waveforms[:, :, None], grid, mode="bilinear", padding_mode="zeros", align_corners=True)
+        return out[:, :, 0]
+
+    def add_noise(self, waveforms: torch.Tensor) -> torch.Tensor:
+        """noise segments (the same in all channels of a clip) at a random SNR each"""
+        batch, _, time = waveforms.shape
+        if self.noise is None:
+            noise = torch.randn(batch, time, generator=self.generator)
+        else:
+            bank = self.noise
+            if len(bank) < time:
+                bank = bank.repeat(math.ceil(time / len(bank)))
+            start = torch.randint(0, len(bank) - time + 1, (batch,), generator=self.generator)
+            noise = bank[start[:, None] + torch.arange(time)]
+        # power of the clips without their zero padding
+        signal_power = waveforms.pow(2).sum(dim=(1, 2)) / (waveforms != 0).sum(dim=(1, 2)).clamp(min=1)
+        noise_power = noise.pow(2).mean(dim=1).clamp(min=1e-10)
+        snr = self._uniform(*self.snr_db, batch)
+        scale = torch.sqrt(signal_power / noise_power * 10 ** (-snr / 10))
+        scale = torch.where(torch.rand(batch, generator=self.generator) < self.p_noise, scale, torch.zeros(batch))
+        return waveforms + (scale[:, None] * noise)[:, None]
+
+    def __call__(self, waveforms: torch.Tensor) -> torch.Tensor:
+        """augmented copy of a (batch, channels, time) batch"""
+        waveforms = self.warp(waveforms)
+        waveforms = self.add_noise(waveforms)
+        gain = 10 ** (self._uniform(*self.gain_db, waveforms.shape[0]) / 20)
+        return waveforms * gain[:, None, None]
+
+    def collate(self, collate_fn: Optional[Callable] = None) -> Callable:
+        """collate_fn for a DataLoader: batches (waveforms, targets) from collate_fn, augmented"""
+        return _AugmentedCollate(self, collate_fn)
+
+
+class _AugmentedCollate:
+    # a class rather than a closure, so DataLoader workers can unpickle it
+    def __init__(self, augment: Augment, collate_fn: Optional[Callable]):
+        self.augment = augment
+        self.collate_fn = collate_fn
+
+    def __call__(self, batch):
+        waveforms, targets = self.collate_fn(batch) if self.collate_fn is not None else batch
+        return self.augment(waveforms), targets
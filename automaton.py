@@ -1,17 +1,25 @@
-from typing import List, Optional, Dict, Callable, Union
+from typing import List, Optional, Dict, Callable, Sequence, Union
 from subprocess import Popen
+import contextlib
+import importlib
 import logging
 import os
 import random
+import threading
+import time
 
 import speech_recognition as sr
 
+from capture import MicrophoneSession
+from cascade import KeywordDecision
 from custom_recognizer import CustomRecognizer
-from keywords import KeywordModel
+from noise_floor import NoiseFloorTracker
+from kw_runtime import select_runtime
+from kw_worker import KeywordWorker
 
 
 DEBUG = 1
-__all__ = ["State", "VoiceControlledAutomaton", "Exit"]
+__all__ = ["State", "VoiceControlledAutomaton", "Exit", "LazyAutomaton"]
 
 class State:
     # all subclass VCA FSA's states must inherit from this
@@ -29,6 +37,59 @@ class Exit(Exception):
     def __bool__(self):
         return bool(self.text)
 
+class LazyAutomaton:
+    """
+    Stand-in for a sub automaton that imports its module and constructs it
+    only when first needed (calling it, or prewarm() from a background thread).
+    factory is "module:Class" or any callable taking the constructor kwargs.
+    """
+    def __init__(self, factory: Union[str, Callable], **kwargs):
+        self.factory = factory
+        self.kwargs = kwargs
+        self._automaton = None
+        self._lock = threading.Lock()
+        self.build_time: Optional[float] = None
+        self.built_by: Optional[str] = None # "demand" or "prewarm"
+
+    def __str__(self):
+        return self.factory if isinstance(self.factory, str) else getattr(self.factory, "__name__", repr(self.factory))
+
+    @property
+    def built(self) -> bool:
+        return self._automaton is not None
+
+    def get(self, _by: str = "demand") -> "VoiceControlledAutomaton":
+        if self._automaton is None:
+            with self._lock:
+                if self._automaton is None:
+                    start = time.perf_counter()
+                    factory = self.factory
+                    if isinstance(factory, str):
+                        module, name = factory.split(":")
+                        factory = getattr(importlib.import_module(module), name)
+                    self._automaton = factory(**self.kwargs)
+                    self.build_time = time.perf_counter() - start
+                    self.built_by = _by
+        return self._automaton
+
+    def prewarm(self) -> None:
+        self.get(_by="prewarm")
+
+    def __call__(self, text):
+        return self.get()(text)
+
+    def __getattr__(self, attr):
+        # only reached for attributes LazyAutomaton doesnt have itself
+        if attr.startswith("_"):
+            raise AttributeError(attr)
+        return getattr(self.get(), attr)
+
+    def report(self) -> str:
+        if not self.built:
+            return f"{self}: deferred"
+        return f"{self}: built on {self.built_by} in {self.build_time:.2f} s"
+
+
 class VoiceControlledAutomaton:
     """
     A Voice Controlled
@@ -56,8 +117,18 @@ class VoiceControlledAutomaton:
         mic_index=1,
         sound_dir="./wavs/",
         kw_model_path: str="/home/pi/audio/hal/models/audio_model_fp32.pt",
+        kw_model_int8_path: Optional[str]="/home/pi/audio/hal/models/audio_model_int8.pt",
+        kw_model_paths: Sequence[str]=(),
+        kw_backend: Optional[str]=None,
+        kw_threads: int=1,
+        kw_accuracy_floor: Optional[float]=None,
         n_keywords: int=8,
         sampling_rate: int=16000,
+        preroll_seconds: float=3.0,
+        kw_process: bool=False,
+        capture: Optional[MicrophoneSession]=None,
+        stt: Optional[Callable[[sr.AudioData], str]]=None,
+        kw_decision: Optional[KeywordDecision]=None,
         log_automaton_utterances: bool=True,
         log_user_utterances: bool=True,
         **kwargs
@@ -75,17 +146,58 @@ class VoiceControlledAutomaton:
             self.keywords += _super.keywords
             self.kw_model = _super.kw_model
             self.R = _super.R
+            self.capture = _super.capture
+            self.stt = _super.stt
+            self.noise_floor = _super.noise_floor
             self.name = name
             self.logger = _super.logger
             self.log_user_utterances = _super.log_user_utterances
             self.log_automaton_utterances = _super.log_automaton_utterances
         else:
-            self.R = CustomRecognizer()
+            # kw_decision: posterior smoothing, per keyword thresholds and directly dispatched commands
+            self.R = CustomRecognizer(keyword_decision=kw_decision)
+            # one microphone stream for the whole process, shared by all sub automata
+            # (or any other session, e.g. replay.ReplaySession)
+            if capture is None:
+                capture = MicrophoneSession(
+                    device_index=self.mic_index,
+                    preroll_seconds=preroll_seconds
+                )
+            self.capture = capture
+            # speech to text backend, AudioData -> text, raising sr.UnknownValueError/sr.RequestError
+            self.stt = stt if stt is not None else self.R.recognize_google
+            # energy threshold is kept up to date in the background from the live stream
+            self.noise_floor = NoiseFloorTracker(self.R, self.capture.seconds_per_buffer)
+            self.capture.noise_floor = self.noise_floor
+            self.R.dynamic_energy_threshold = False
             self.name = name
             self.logger = logging.getLogger(name=self.name)
             self.logger.setLevel(logging.INFO)
-            if DEBUG: kw_model_path = None
-            self.kw_model = KeywordModel(model_path=kw_model_path)
+            # exported artifacts + metadata sidecars, no training stack; benchmark fp32, int8
+            # and any other exports (kw_model_paths, e.g. mobile/ONNX from kw_export.py)
+            # on this machine and keep the fastest accurate enough one
+            kw_runtime = select_runtime(
+                [kw_model_path, kw_model_int8_path, *kw_model_paths],
+                accuracy_floor=kw_accuracy_floor,
+                backend=kw_backend,
+                num_threads=kw_threads,
+            )
+            if kw_runtime is None:
+                self.logger.warning("No usable keyword model found, falling back to energy based listening")
+                self.kw_model = None
+            elif kw_process:
+                # keyword model runs in its own process, started/stopped by self.run
+                self.kw_model = KeywordWorker(
+                    model_path=kw_runtime.path,
+                    window_ms=self.R.keyword_window_ms,
+                    hop_ms=self.R.keyword_hop_ms,
+                    max_lag_ms=self.R.keyword_max_lag_ms,
+                    backend=kw_backend,
+                    num_threads=kw_threads,
+                    decision=self.R.keyword_decision,
+                )
+            else:
+                self.kw_model = kw_runtime
             self.log_user_utterances = log_user_utterances
             self.log_automaton_utterances = log_automaton_utterances
 
@@ -122,6 +234,8 @@ class VoiceControlledAutomaton:
             self.logger.info(s)
         if wait:
             say_process.wait()
+            # dont let the next listen pick up our own voice from the pre-roll
+            self.capture.skip()
 
     def keyword_transition(self) -> None:
         # listen to input and make state transition with side effects
@@ -143,19 +257,27 @@ class VoiceControlledAutomaton:
         return self.run()
 
     def run(self):
-        while True:
-            try:
-                self.keyword_transition()
-            except Exit as couldnt_handle:
-                print(f"{self} received Exit")
-                # self.keyword_transition()
-                self.reset()
-                if self.super is not None:
-                    print(f"{self} passes to super")
-                    raise couldnt_handle
-                else:
-                    print(f"{self} passes")
-                    pass
+        with self.keyword_engine():
+            while True:
+                try:
+                    self.keyword_transition()
+                except Exit as couldnt_handle:
+                    print(f"{self} received Exit")
+                    # self.keyword_transition()
+                    self.reset()
+                    if self.super is not None:
+                        print(f"{self} passes to super")
+                        raise couldnt_handle
+                    else:
+                        print(f"{self} passes")
+                        pass
+
+    def keyword_engine(self):
+        # the top level automaton owns the keyword worker process (if any)
+        # for exactly as long as it runs
+        if self.super is None and isinstance(self.kw_model, KeywordWorker):
+            return self.kw_model
+        return contextlib.nullcontext()
 
     def reset(self):
         self.state = State.enter
@@ -168,8 +290,10 @@ class VoiceControlledAutomaton:
         return new_state
 
     def listen(self, for_keyword=True):
-        with sr.Microphone(device_index=self.mic_index) as source:
-            self.R.adjust_for_ambient_noise(source)
+        # no calibration here, self.noise_floor tracks the threshold continuously;
+        # starts with whatever was said since the last utterance (pre-roll)
+        self.R.last_keyword = None
+        with self.capture.source() as source:
             self.logger.info("Waiting for voice input")
 
             if for_keyword:
@@ -192,7 +316,7 @@ class VoiceControlledAutomaton:
 
     def recognize(self, audio):
         try:
-            text = self.R.recognize_google(audio).lower()
+            text = self.stt(audio).lower()
             # text = self.R.recognize_sphinx(audio).lower()
 
             self.play_sound("blung")
@@ -221,6 +345,13 @@ class VoiceControlledAutomaton:
 
     def get_utterance(self, keyword=True) -> str:
         audio = self.listen(for_keyword=keyword)
+        command = self.R.keyword_command() if keyword else None
+        if command is not None:
+            # confidently detected in-vocabulary command: straight to respond_to_input,
+            # without the speech to text round trip
+            self.play_sound("blung")
+            self.logger.info("got keyword command: "+command)
+            return command
         text = self.recognize(audio)
         return text
 
@@ -0,0 +1,86 @@
+from typing import Iterator, List, Optional, Sequence
+import math
+
+import numpy as np
+from torch.utils.data import Sampler
+
+__all__ = ["BucketBatchSampler", "padding_ratio"]
+
+"""
+Length bucketed batches: batches are padded to their longest clip, so clips
+of similar length should be batched together. Every epoch the indices are
+shuffled, cut into chunks of bucket_batches batches, each chunk sorted by
+length and split into batches, and the batches shuffled again. Batches stay
+random (any clip can meet any other of similar length, in any order) while
+hardly any padding is convolved.
+
+    loader = DataLoader(dataset, batch_sampler=BucketBatchSampler(dataset.num_samples, 128, seed=0), ...)
+
+Without shuffle (validation, batched evaluation) all clips are sorted by
+length once, the least padding possible.
+"""
+
+
+class BucketBatchSampler(Sampler):
+    """
+    lengths: length of every item (e.g. dataset.num_samples)
+    bucket_batches: batches per sorted chunk; 1 is plain random batching, len(lengths) / batch_size fully sorted
+    seed: the order of epoch e depends only on (seed, e); the epoch advances with every iteration
+        unless set with set_epoch
+    """
+    def __init__(
+            self,
+            lengths: Sequence[int],
+            batch_size: int,
+            shuffle: bool = True,
+            drop_last: bool = False,
+            bucket_batches: int = 50,
+            seed: int = 0,
+        ):
+        self.lengths = np.asarray(lengths)
+        self.batch_size = int(batch_size)
+        self.shuffle = shuffle
+        self.drop_last = drop_last
+        self.bucket_batches = max(1, int(bucket_batches))
+        self.seed = seed
+        self.epoch = 0
+
+    def set_epoch(self, epoch: int) -> None:
+        self.epoch = epoch
+
+    def batches(self, epoch: Optional[int] = None) -> List[np.ndarray]:
+        """index batches of an epoch (default: the current one)"""
+        n = len(self.lengths)
+        if not self.shuffle:
+            order = np.argsort(self.lengths, kind="stable")
+            return [order[i:i + self.batch_size] for i in range(0, len(self) * self.batch_size, self.batch_size)]
+        rng = np.random.default_rng([self.seed, self.epoch if epoch is None else epoch])
+        order = rng.permutation(n)
+        if self.drop_last:
+            # the clips left over are random ones, not the longest
+            order = order[:n - n % self.batch_size]
+        chunk = self.batch_size * self.bucket_batches
+        batches = []
+        for start in range(0, len(order), chunk):
+            bucket = order[start:start + chunk]
+            bucket = bucket[np.argsort(self.lengths[bucket], kind="stable")]
+            batches += [bucket[i:i + self.batch_size] for i in range(0, len(bucket), self.batch_size)]
+        return [batches[i] for i in rng.permutation(len(batches))]
+
+    def __iter__(self) -> Iterator[List[int]]:
+        batches = self.batches()
+        self.epoch += 1
+        for batch in batches:
+            yield batch.tolist()
+
+    def __len__(self) -> int:
+        if self.drop_last:
+            return len(self.lengths) // self.batch_size
+        return math.ceil(len(self.lengths) / self.batch_size)
+
+
+def padding_ratio(lengths: Sequence[int], batches: Sequence[Sequence[int]]) -> float:
+    """fraction of the padded batch samples that are padding"""
+    lengths = np.asarray(lengths)
+    padded = sum(len(b) * lengths[b].max() for b in batches)
+    return 1. - sum(lengths[b].sum() for b in batches) / padded
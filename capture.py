@@ -0,0 +1,171 @@
+from typing import Optional
+import atexit
+import collections
+import math
+import threading
+
+import speech_recognition as sr
+
+__all__ = ["MicrophoneSession", "SessionSource"]
+
+
+class MicrophoneSession:
+    """
+    Keeps one sr.Microphone (and its PyAudio stream) open for the whole process.
+
+    A daemon thread reads the microphone continuously and keeps the last
+    preroll_seconds of chunks. Listeners get a SessionSource, a regular
+    sr.AudioSource whose stream starts a little in the past (the pre-roll),
+    so nothing said between two turns is lost and no device has to be
+    opened or calibrated per utterance (see noise_floor.NoiseFloorTracker).
+    """
+    def __init__(
+            self,
+            device_index: Optional[int] = None,
+            sample_rate: Optional[int] = None,
+            chunk_size: int = 1024,
+            preroll_seconds: float = 3.0,
+        ):
+        self.microphone = sr.Microphone(device_index=device_index, sample_rate=sample_rate, chunk_size=chunk_size)
+        self.SAMPLE_RATE = self.microphone.SAMPLE_RATE
+        self.SAMPLE_WIDTH = self.microphone.SAMPLE_WIDTH
+        self.CHUNK = self.microphone.CHUNK
+        self.format = self.microphone.format
+        self._init_history(preroll_seconds)
+
+    def _init_history(self, preroll_seconds: float) -> None:
+        self.seconds_per_buffer = float(self.CHUNK) / self.SAMPLE_RATE
+
+        self.preroll_seconds = preroll_seconds
+        self.preroll_count = int(math.ceil(preroll_seconds / self.seconds_per_buffer))
+
+        # history of captured chunks; _captured counts all chunks ever read,
+        # so (_captured - len(_chunks)) is the sequence number of _chunks[0]
+        self._chunks = collections.deque(maxlen=self.preroll_count)
+        self._captured = 0
+        # first chunk no listener has seen yet; pre-roll never reaches behind it
+        self._consumed = 0
+        self._cond = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+        self._running = False
+        # optional NoiseFloorTracker fed with every captured chunk
+        self.noise_floor = None
+
+    @property
+    def running(self) -> bool:
+        return self._running
+
+    def start(self) -> "MicrophoneSession":
+        """Open the device and start capturing; idempotent."""
+        if self._running:
+            return self
+        self._open()
+        self._running = True
+        self._thread = threading.Thread(target=self._capture, name="mic-session", daemon=True)
+        self._thread.start()
+        atexit.register(self.stop)
+        return self
+
+    def stop(self) -> None:
+        if not self._running:
+            return
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+        if self._thread is not threading.current_thread():
+            self._thread.join()
+        self._close()
+
+    # device specific part, see replay.ReplaySession for another one
+    def _open(self) -> None:
+        self.microphone.__enter__()
+
+    def _close(self) -> None:
+        self.microphone.__exit__(None, None, None)
+
+    def _read(self) -> bytes:
+        return self.microphone.stream.read(self.CHUNK)
+
+    def _capture(self) -> None:
+        while self._running:
+            buffer = self._read()
+            if not buffer:
+                # source exhausted
+                self.stop()
+                return
+            if self.noise_floor is not None:
+                self.noise_floor.update(buffer, self.SAMPLE_WIDTH)
+            with self._cond:
+                self._chunks.append(buffer)
+                self._captured += 1
+                self._cond.notify_all()
+
+    def read_chunk(self, position: int):
+        """
+        Blocking read of the chunk with sequence number position.
+        Returns (buffer, next position); b"" once the session is stopped.
+        If position already fell out of the history, the oldest kept chunk is returned.
+        """
+        with self._cond:
+            while self._running and position >= self._captured:
+                self._cond.wait()
+            if position >= self._captured:
+                return b"", position
+            oldest = self._captured - len(self._chunks)
+            position = max(position, oldest)
+            self._consumed = max(self._consumed, position + 1)
+            return self._chunks[position - oldest], position + 1
+
+    def skip(self) -> None:
+        """Mark everything captured so far as consumed (e.g. hal's own voice)."""
+        with self._cond:
+            self._consumed = self._captured
+
+    def source(self, preroll: Optional[float] = None) -> "SessionSource":
+        """
+        A fresh AudioSource reading from this session.
+        Its stream starts preroll seconds (default: all kept history) in the past,
+        but never before audio an earlier source already read.
+        """
+        self.start()
+        if preroll is None:
+            count = self.preroll_count
+        else:
+            count = int(math.ceil(preroll / self.seconds_per_buffer))
+        with self._cond:
+            start = max(self._captured - min(count, len(self._chunks)), self._consumed)
+        return SessionSource(self, start)
+
+
+class SessionSource(sr.AudioSource):
+    """
+    AudioSource view of a MicrophoneSession, usable wherever an entered
+    sr.Microphone is (recognizer.listen, adjust_for_ambient_noise, ...).
+    """
+    def __init__(self, session: MicrophoneSession, position: int):
+        self.session = session
+        self.SAMPLE_RATE = session.SAMPLE_RATE
+        self.SAMPLE_WIDTH = session.SAMPLE_WIDTH
+        self.CHUNK = session.CHUNK
+        self.format = session.format
+        self.stream = SessionSource.SessionStream(session, position)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # the underlying device stays open
+        return
+
+    class SessionStream(object):
+        def __init__(self, session: MicrophoneSession, position: int):
+            self.session = session
+            self.position = position
+
+        def read(self, size):
+            # chunks are handed out as captured; size is always session.CHUNK here
+            buffer, self.position = self.session.read_chunk(self.position)
+            return buffer
+
+        def close(self):
+            return
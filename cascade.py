@@ -0,0 +1,121 @@
+from typing import Callable, Dict, Optional, Sequence, Tuple
+import collections
+
+import torch
+
+__all__ = ["KeywordCascade", "KeywordDecision", "DEFAULT_COMMANDS"]
+
+# keywords that are whole commands on their own (no argument after them),
+# acted on without speech to text when detected confidently enough
+DEFAULT_COMMANDS = ("enough", "local", "louder", "music", "options", "play", "quieter", "youtube")
+
+
+class KeywordCascade:
+    """
+    Cheap stages in front of the full keyword model in CustomRecognizer.wait_for_keyword:
+
+    1. energy gate: RMS of the newest gate_ms of the window against the
+       recognizer's (background tracked) energy_threshold; stays open for
+       hangover_ms after firing so the model sees the word slide through the window
+    2. optional first_stage: a very small classifier run on the same input as
+       the full model; passes if it also decides on a class > 0
+
+    Only windows passing every stage reach the full model.
+    """
+    def __init__(
+            self,
+            gate: bool = True,
+            gate_ms: float = 300,
+            gate_ratio: float = 1.0,
+            hangover_ms: float = 1000,
+            first_stage: Optional[Callable[[torch.Tensor], torch.Tensor]] = None,
+        ):
+        self.use_gate = gate
+        self.gate_ms = gate_ms
+        self.gate_ratio = gate_ratio
+        self.hangover_ms = hangover_ms
+        self.first_stage = first_stage
+        self.reset()
+
+    def reset(self) -> None:
+        self._open_until = -1 # ring position up to which the gate stays open
+
+    def gate(self, window: torch.Tensor, end: int, sample_rate: int, energy_threshold: float, sample_width: int = 2) -> bool:
+        """
+        window: float samples in [-1, 1) ending at ring position end;
+        energy_threshold in audioop.rms units of sample_width PCM (like Recognizer.energy_threshold)
+        """
+        if not self.use_gate or end <= self._open_until:
+            return True
+        n = min(len(window), max(1, int(sample_rate * self.gate_ms / 1000)))
+        rms = torch.linalg.vector_norm(window[-n:]).item() / n ** .5
+        threshold = self.gate_ratio * energy_threshold / 2 ** (8 * sample_width - 1)
+        if rms > threshold:
+            self._open_until = end + int(sample_rate * self.hangover_ms / 1000)
+            return True
+        return False
+
+    def first_stage_passes(self, inp: torch.Tensor) -> bool:
+        if self.first_stage is None:
+            return True
+        with torch.no_grad():
+            return self.first_stage(inp).argmax(dim=-1).item() > 0
+
+
+class KeywordDecision:
+    """
+    Last stage, after the full keyword model in CustomRecognizer.wait_for_keyword:
+    per class posteriors are averaged over the last smoothing checks, and the
+    best keyword whose smoothed posterior reaches its threshold is detected
+    (thresholds per label, threshold for all others).
+    Labels starting with "_" (_silence_, _unknown_, ...) are never detected.
+
+    commands: keywords that are complete commands, with the smoothed posterior
+    needed to dispatch them directly instead of asking speech to text
+    (see CustomRecognizer.keyword_command).
+    """
+    def __init__(
+            self,
+            threshold: float = .5,
+            thresholds: Optional[Dict[str, float]] = None,
+            smoothing: int = 3,
+            commands: Optional[Dict[str, float]] = None,
+        ):
+        assert smoothing >= 1
+        self.threshold = threshold
+        self.thresholds = dict(thresholds or {})
+        self.smoothing = smoothing
+        self.commands = dict(commands) if commands is not None else {label: .9 for label in DEFAULT_COMMANDS}
+        self.labels: Optional[Sequence[str]] = None
+        self._class_thresholds: Optional[torch.Tensor] = None
+        self.reset()
+
+    def reset(self, labels: Optional[Sequence[str]] = None) -> None:
+        """forget the posterior history; labels of the model's classes, if known"""
+        self._history = collections.deque(maxlen=self.smoothing)
+        self.smoothed: Optional[torch.Tensor] = None
+        if labels is not None and list(labels) != self.labels:
+            self.labels = list(labels)
+            self._class_thresholds = None
+
+    def _thresholds(self, n_classes: int) -> torch.Tensor:
+        if self._class_thresholds is None or len(self._class_thresholds) != n_classes:
+            if self.labels is None or len(self.labels) != n_classes:
+                self.labels = [str(i) for i in range(n_classes)]
+            self._class_thresholds = torch.tensor([
+                float("inf") if label.startswith("_") else self.thresholds.get(label, self.threshold)
+                for label in self.labels])
+        return self._class_thresholds
+
+    def update(self, posteriors: torch.Tensor) -> Optional[Tuple[int, float]]:
+        """add one check's posteriors (n_classes,); (class, smoothed posterior) on a detection, else None"""
+        self._history.append(posteriors.detach().float().reshape(-1))
+        self.smoothed = torch.stack(tuple(self._history)).mean(dim=0)
+        passing = self.smoothed >= self._thresholds(len(self.smoothed))
+        if not passing.any():
+            return None
+        keyword = torch.where(passing, self.smoothed, torch.zeros_like(self.smoothed)).argmax().item()
+        return keyword, self.smoothed[keyword].item()
+
+    def is_command(self, label: str, score: float) -> bool:
+        return label in self.commands and score >= self.commands[label]
@@ -1,7 +1,8 @@
-from typing import Optional, List
+from typing import Optional, List, Tuple
 import os
 import math
 import collections
+import threading
 import time
 
 import soundfile as sf
@@ -12,10 +13,56 @@ import numpy as np
 
 from speech_recognition import *
 
-__all__ = ["CustomRecognizer"]
+from cascade import KeywordCascade, KeywordDecision
+from kw_worker import KeywordWorker
+from pcm import PCMFrame
+from resample import PolyphaseResampler
+from ring_buffer import AudioRingBuffer
+
+__all__ = ["CustomRecognizer", "KeywordCapture", "KeywordStats"]
 
 class CustomRecognizer(Recognizer):
 
+    def __init__(
+            self,
+            keyword_window_ms: float=1000,
+            keyword_hop_ms: float=50,
+            keyword_max_lag_ms: float=2000,
+            keyword_backpressure: str="latest",
+            keyword_cascade: Optional[KeywordCascade]=None,
+            keyword_offsets: int=1,
+            keyword_offset_ms: float=25,
+            keyword_aggregate: str="max",
+            keyword_decision: Optional[KeywordDecision]=None,
+        ):
+        super().__init__()
+        # length of audio the keyword model sees per check,
+        # and how much new audio has to arrive between two checks
+        # (both independent of source.CHUNK)
+        self.keyword_window_ms = keyword_window_ms
+        self.keyword_hop_ms = keyword_hop_ms
+        # how far inference may fall behind capture before windows are lost
+        self.keyword_max_lag_ms = keyword_max_lag_ms
+        # "latest": skip to the newest window when behind; "every_hop": catch up hop by hop
+        assert keyword_backpressure in ("latest", "every_hop")
+        self.keyword_backpressure = keyword_backpressure
+        # energy gate (+ optional tiny model) in front of the keyword model,
+        # KeywordCascade(gate=False) runs the model on every hop
+        self.keyword_cascade = keyword_cascade if keyword_cascade is not None else KeywordCascade()
+        # score keyword_offsets windows, keyword_offset_ms apart, in one batched forward pass
+        # and aggregate ("max"/"mean") their posteriors; allows a longer hop for the same coverage
+        assert keyword_offsets >= 1 and keyword_aggregate in ("max", "mean")
+        self.keyword_offsets = keyword_offsets
+        self.keyword_offset_ms = keyword_offset_ms
+        self.keyword_aggregate = keyword_aggregate
+        # smoothed posteriors against per keyword thresholds after the full model,
+        # and which keywords are commands to dispatch without speech to text
+        self.keyword_decision = keyword_decision if keyword_decision is not None else KeywordDecision()
+        self.keyword_stats = KeywordStats()
+        # (label, smoothed posterior) of the keyword detected by the latest wait_for_keyword
+        self.last_keyword: Optional[Tuple[str, float]] = None
+        self._kw_ring: Optional[AudioRingBuffer] = None
+
     def listen_from_keyword_on(self, source, timeout=None, phrase_time_limit=None, keyword_model= None):
         # assert False, "got here"
         assert isinstance(source, AudioSource), "Source must be an audio source"
@@ -64,6 +111,9 @@ class CustomRecognizer(Recognizer):
                 elapsed_time += delta_time
                 if len(buffer) == 0: break  # reached end of the stream
                 frames.append(buffer)
+                if self.keyword_command() is not None:
+                    # the keyword is the whole command, no phrase to wait for
+                    return AudioData(b"".join(frames), source.SAMPLE_RATE, source.SAMPLE_WIDTH)
 
             # read audio input until the phrase ends
             pause_count, phrase_count = 0, 0
@@ -104,55 +154,237 @@ class CustomRecognizer(Recognizer):
         # keyword_model.SetAudioGain(1.0)
         # keyword_model.SetSensitivity(",".join(["0.4"] * len(keyword_key_word_files)).encode())
         kw_sample_rate = keyword_model.sample_rate
+        self.last_keyword = None
 
         """
         Specs while training keyword model:
         * sampling rate
+
+        Capture (reading source.stream + resampling) runs on a KeywordCapture
+        producer thread that never waits for the model; this thread is the
+        consumer and looks at the last keyword_window_ms of the ring every
+        keyword_hop_ms of new audio. If the model is slower than that, stale
+        windows are skipped (or, with keyword_backpressure="every_hop", worked
+        through as long as the ring still holds them), but no audio is dropped.
         """
 
-        elapsed_time = 0
+        if isinstance(keyword_model, KeywordWorker):
+            return self._wait_for_keyword_in_worker(source, keyword_model, timeout)
+
         seconds_per_buffer = float(source.CHUNK) / source.SAMPLE_RATE
-        resampling_state = None
-
-        # buffers capable of holding 5 seconds of original audio
-        five_seconds_buffer_count = int(math.ceil(5 / seconds_per_buffer))
-        # buffers capable of holding 0.5 seconds of resampled audio
-        half_second_buffer_count = int(math.ceil(0.5 / seconds_per_buffer))
-        frames = collections.deque(maxlen=five_seconds_buffer_count)
-        resampled_frames = collections.deque(maxlen=half_second_buffer_count)
-        # keyword check interval
-        check_interval = 0.05
-        last_check = time.time()
-        while True:
-            elapsed_time += seconds_per_buffer
-            if timeout and elapsed_time > timeout:
-                raise WaitTimeoutError("listening timed out while waiting for keyword to be said")
-
-            buffer = source.stream.read(source.CHUNK)
-            if len(buffer) == 0:
-                break # reached end of the stream
-            frames.append(buffer)
-
-            # resample audio to the required sample rate
-            resampled_buffer, resampling_state = audioop.ratecv(buffer, source.SAMPLE_WIDTH, 1, source.SAMPLE_RATE, kw_sample_rate, resampling_state)
-            resampled_frames.append(resampled_buffer)
-
-            if time.time() - last_check > check_interval:
-                # run keyword detection on the resampled audio
-                print("passing keyword to model ...")
-                inp = b"".join(resampled_frames)
-                print(inp)
-                inp = bytearray(inp)
-                print(inp)
-                arr = torch.Tensor(np.array(inp, dtype=np.float32))
-                print(arr)
-                inp = torch.stack([arr, arr], dim=0).unsqueeze(0)
-
-                keyword_result = keyword_model(inp)
-                print(f"model decided on class {keyword_result}")
-                if keyword_result > 0:
+        stats = self.keyword_stats
+
+        ring = self._keyword_ring(kw_sample_rate)
+        window = ring.ms_to_samples(self.keyword_window_ms)
+        hop = max(1, ring.ms_to_samples(self.keyword_hop_ms))
+        step = max(1, ring.ms_to_samples(self.keyword_offset_ms))
+        # audio covered by all offsets of one check
+        span = window + (self.keyword_offsets - 1) * step
+        signal = torch.empty(span)
+        # newest window, duplicated into the two input channels without copying
+        model_inp = signal[-window:].view(1, 1, window).expand(1, 2, window)
+
+        cascade = self.keyword_cascade
+        cascade.reset()
+        decision = self.keyword_decision
+        decision.reset(getattr(keyword_model, "labels", None))
+
+        capture = KeywordCapture(source, ring, stats)
+        capture.start()
+        next_check = span # ring.written at which the next check ends
+        try:
+            while True:
+                with capture.cond:
+                    while not capture.ended and ring.written < next_check:
+                        capture.cond.wait()
+                    if capture.error is not None:
+                        raise capture.error
+                    if ring.written < next_check:
+                        break # reached end of the stream
+
+                    elapsed_time = capture.chunks * seconds_per_buffer
+                    if timeout and elapsed_time > timeout:
+                        raise WaitTimeoutError("listening timed out while waiting for keyword to be said")
+
+                    lag = ring.written - next_check
+                    if lag > ring.capacity - span:
+                        # fell so far behind that the window was overwritten
+                        stats.overruns += 1
+                        next_check = ring.written
+                    elif lag >= hop and self.keyword_backpressure == "latest":
+                        stats.skipped_checks += lag // hop
+                        next_check = ring.written
+                    view = ring.latest(span, offset=ring.written - next_check)
+                    stats.windows += 1
+
+                    # stage 1: energy gate, on the ring directly
+                    if not cascade.gate(
+                            view, next_check, ring.sample_rate,
+                            self.energy_threshold, source.SAMPLE_WIDTH):
+                        next_check += hop
+                        continue
+                    stats.gate_passes += 1
+                    signal.copy_(view)
+
+                # run keyword detection on the resampled audio, capture goes on meanwhile
+                next_check += hop
+                # stage 2: optional tiny model
+                if not cascade.first_stage_passes(model_inp):
+                    continue
+                stats.first_stage_passes += 1
+
+                # stage 3: full model
+                if self.keyword_offsets > 1:
+                    posteriors = keyword_model.score_windows(signal, window, step, self.keyword_aggregate)
+                else:
+                    with torch.no_grad():
+                        posteriors = keyword_model(model_inp).softmax(dim=-1)[0]
+                stats.checks += 1
+                # stage 4: smoothed posteriors against the keyword thresholds
+                detection = decision.update(posteriors)
+                if detection is not None:
+                    keyword_result, score = detection
+                    stats.detections += 1
+                    # end of the detected window, in ring samples since this wait started
+                    stats.last_detection = (next_check - hop, keyword_result, score)
+                    self.last_keyword = (decision.labels[keyword_result], score)
+                    print(f"model decided on class {keyword_result}")
                     break  # wake word found !
-                resampled_frames.clear()
-                last_check = time.time()
+        finally:
+            capture.stop()
+
+        elapsed_time = capture.chunks * seconds_per_buffer
+        return b"".join(capture.frames), elapsed_time
+
+    def _wait_for_keyword_in_worker(self, source, worker: KeywordWorker, timeout=None):
+        """
+        Same as wait_for_keyword, but the model runs in the worker process:
+        capture writes into the worker's shared ring and we only wait for its events.
+        """
+        assert worker.running, "keyword worker must be started first, see KeywordWorker"
+        seconds_per_buffer = float(source.CHUNK) / source.SAMPLE_RATE
+        stats = self.keyword_stats
+
+        # detections for windows ending before this are left over from an earlier wait
+        start = worker.ring.written
+        capture = KeywordCapture(source, worker.ring, stats)
+        capture.start()
+        try:
+            while True:
+                event = worker.poll(timeout=self.keyword_hop_ms / 1000)
+                if capture.error is not None:
+                    raise capture.error
+                if event is not None:
+                    kind, payload = event
+                    if kind == "overrun":
+                        stats.overruns += 1
+                    elif kind == "detection":
+                        end, keyword_result, label, score = payload
+                        if end > start:
+                            stats.detections += 1
+                            self.last_keyword = (label, score)
+                            print(f"model decided on class {keyword_result}")
+                            break  # wake word found !
+                    continue
+                if capture.ended:
+                    break # reached end of the stream
+                if timeout and capture.chunks * seconds_per_buffer > timeout:
+                    raise WaitTimeoutError("listening timed out while waiting for keyword to be said")
+        finally:
+            capture.stop()
+
+        elapsed_time = capture.chunks * seconds_per_buffer
+        return b"".join(capture.frames), elapsed_time
+
+    def keyword_command(self) -> Optional[str]:
+        """
+        Text of the keyword detected by the latest wait_for_keyword if it is a command
+        confident enough to act on directly (see KeywordDecision.commands), else None.
+        """
+        if self.last_keyword is None:
+            return None
+        label, score = self.last_keyword
+        if not self.keyword_decision.is_command(label, score):
+            return None
+        return label.replace("_", " ")
+
+    def _keyword_ring(self, sample_rate: int) -> AudioRingBuffer:
+        # reuse the ring across calls; only reallocate if the geometry changed
+        span_ms = self.keyword_window_ms + (self.keyword_offsets - 1) * self.keyword_offset_ms
+        capacity = int(math.ceil(sample_rate * (span_ms + self.keyword_max_lag_ms) / 1000))
+        ring = self._kw_ring
+        if ring is None or ring.sample_rate != sample_rate or ring.capacity != capacity:
+            ring = self._kw_ring = AudioRingBuffer(capacity, sample_rate)
+        else:
+            ring.clear()
+        return ring
+
+
+class KeywordStats:
+    """Counters of the wake word loop, kept across calls (see CustomRecognizer.keyword_stats)."""
+    def __init__(self):
+        self.chunks = 0 # chunks captured
+        self.windows = 0 # windows looked at
+        self.gate_passes = 0 # windows passing the energy gate (see cascade.KeywordCascade)
+        self.first_stage_passes = 0 # windows passing the tiny first stage model
+        self.checks = 0 # full model invocations
+        self.detections = 0
+        self.skipped_checks = 0 # hops not looked at because inference was behind
+        self.overruns = 0 # times inference fell behind by more than the ring holds
+        self.last_detection = None # (window end sample, class, posterior) of the latest detection
+
+    def __repr__(self):
+        return "KeywordStats(" + ", ".join(f"{k}={v}" for k, v in vars(self).items()) + ")"
+
+
+class KeywordCapture(threading.Thread):
+    """
+    Producer half of CustomRecognizer.wait_for_keyword:
+    reads source.stream, keeps history_seconds of the original audio in
+    self.frames and writes the audio, resampled to ring.sample_rate, into ring.
+    Never blocks on the consumer, so the input device is always drained.
+    """
+    def __init__(self, source, ring: AudioRingBuffer, stats: KeywordStats, history_seconds: float=5):
+        super().__init__(name="keyword-capture", daemon=True)
+        self.source = source
+        self.ring = ring
+        self.stats = stats
+        seconds_per_buffer = float(source.CHUNK) / source.SAMPLE_RATE
+        self.frames = collections.deque(maxlen=int(math.ceil(history_seconds / seconds_per_buffer)))
+        # guards frames and ring; notified on every chunk and when capture ends
+        self.cond = threading.Condition()
+        self.chunks = 0
+        self.ended = False
+        self.error: Optional[BaseException] = None
+        self._stopping = False
+
+    def run(self):
+        source = self.source
+        # same filter bank as HAL_KW.transform uses for the training data
+        resampler = PolyphaseResampler(source.SAMPLE_RATE, self.ring.sample_rate)
+        try:
+            while not self._stopping:
+                buffer = source.stream.read(source.CHUNK)
+                if len(buffer) == 0:
+                    break # reached end of the stream
+
+                # resample audio to the required sample rate
+                frame = PCMFrame(buffer, source.SAMPLE_WIDTH, 1, source.SAMPLE_RATE)
+                resampled = resampler.push(frame.to_tensor())[0].numpy()
+                with self.cond:
+                    self.frames.append(buffer)
+                    self.ring.write(resampled)
+                    self.chunks += 1
+                    self.stats.chunks += 1
+                    self.cond.notify_all()
+        except BaseException as e:
+            self.error = e
+        finally:
+            with self.cond:
+                self.ended = True
+                self.cond.notify_all()
 
-        return b"".join(frames), elapsed_time
+    def stop(self):
+        # finishes the read in progress, so no chunk is torn
+        self._stopping = True
+        self.join()
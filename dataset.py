@@ -1,23 +1,18 @@
 import os
-from typing import Tuple, Optional, Union
+from typing import Dict, List, Tuple, Optional, Union
 from pathlib import Path
 
+import numpy as np
 import torchaudio
 from torch.utils.data import Dataset
 from torch import Tensor
 
+from manifest import DatasetManifest
+from pcm import PCMFrame
+
 EXCEPT_FOLDER = "_background_noise_"
 FOLDER_IN_ARCHIVE = "hal_keywords"
 
-def _load_list(root, *filenames):
-    output = []
-    for filename in filenames:
-        filepath = os.path.join(root, filename)
-        with open(filepath) as fileobj:
-            output += [os.path.normpath(os.path.join(root, line.strip())) for line in fileobj]
-    return output
-
-
 def low_hal_kw_item(filepath: str, path: str) -> Tuple[Tensor, int, str, str, int]:
     relpath = os.path.relpath(filepath, path)
     label, filename = os.path.split(relpath)
@@ -30,8 +25,9 @@ def low_hal_kw_item(filepath: str, path: str) -> Tuple[Tensor, int, str, str, in
     # "xxx.wav.wav", so file extensions twice needs to be stripped twice.
     # [1] https://github.com/tensorflow/datasets/blob/master/tensorflow_datasets/url_checksums/speech_commands.txt
     utterance_number = int(stub)
-    # Load audio
-    waveform, sample_rate = torchaudio.load(filepath)
+    # Load raw PCM and normalize it the same way as live microphone audio
+    pcm, sample_rate = torchaudio.load(filepath, normalize=False)
+    waveform = PCMFrame.from_array(pcm.numpy(), sample_rate, channels_first=True).to_tensor()
     return waveform, sample_rate, label, utterance_number
 
 class HAL_KW_DATASET(Dataset):
@@ -49,11 +45,15 @@ class HAL_KW_DATASET(Dataset):
     "validation_list.txt" and "testing_list.txt" are explained in the README of the dataset
     and in the introduction of Section 7 of the original paper and its reference 12. The
     original paper can be found `here <https://arxiv.org/pdf/1804.03209.pdf>`_. (Default: ``None``)
+    refresh_manifest (bool, optional):
+    Check the dataset directory for added, removed or changed clips and update the
+    manifest (see manifest.DatasetManifest); otherwise only the manifest file is read. (Default: ``True``)
     """
     def __init__(self,
             root: Union[str, Path],
             folder_in_archive: str = FOLDER_IN_ARCHIVE,
             subset: Optional[str] = None,
+            refresh_manifest: bool = True,
         ) -> None:
         assert subset is None or subset in ["training", "validation", "testing"]
         "When `subset` not None, it must take a value from "
@@ -62,20 +62,39 @@ class HAL_KW_DATASET(Dataset):
         root = os.fspath(root)
 
         self._path = os.path.join(root, folder_in_archive)
-        if subset == "validation":
-            self._walker = _load_list(self._path, "validation_list.txt")
-        elif subset == "testing":
-            self._walker = _load_list(self._path, "testing_list.txt")
-        elif subset == "training":
-            excludes = set(_load_list(self._path, "validation_list.txt", "testing_list.txt"))
-            walker = sorted(str(p) for p in Path(self._path).glob('*/*.wav'))
-            self._walker = [
-                w for w in walker
-                if  os.path.normpath(w) not in excludes
-            ]
-        else:
-            walker = sorted(str(p) for p in Path(self._path).glob('*/*.wav'))
-            self._walker = [w for w in walker if EXCEPT_FOLDER not in w]
+        # labels, splits and clip lengths without globbing or decoding
+        # ("training" is everything not in validation_list.txt or testing_list.txt)
+        self.manifest = DatasetManifest.load(self._path, refresh=refresh_manifest)
+        self._indices = self.manifest.indices(subset)
+        self._walker = [os.path.join(self._path, p) for p in self.manifest.path[self._indices]]
+
+    @property
+    def labels(self) -> List[str]:
+        """all labels of the dataset, sorted; a label's index is its class"""
+        return self.manifest.labels
+
+    @property
+    def label_to_index(self) -> Dict[str, int]:
+        return self.manifest.label_to_index
+
+    @property
+    def paths(self) -> np.ndarray:
+        """path of every item relative to the dataset root (label/utterance.wav)"""
+        return self.manifest.path[self._indices]
+
+    @property
+    def targets(self) -> np.ndarray:
+        """label index of every item"""
+        return self.manifest.label[self._indices].astype(np.int64)
+
+    @property
+    def num_samples(self) -> np.ndarray:
+        """length of every item in samples, at its own sample rate"""
+        return self.manifest.num_samples[self._indices]
+
+    @property
+    def sample_rates(self) -> np.ndarray:
+        return self.manifest.sample_rate[self._indices]
 
     def __getitem__(self, n: int) -> Tuple[Tensor, int, str, str, int]:
         """Load the n-th sample from the dataset.
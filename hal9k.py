@@ -1,18 +1,18 @@
 # entered with listen, recognize, and main from:
 # https://iotdesignpro.com/projects/speech-recognition-on-raspberry-pi-for-voice-controlled-home-automation
 
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, Union
 from subprocess import Popen
 import logging
 import random
+import threading
+import time
 
 from custom_recognizer import CustomRecognizer
-from automaton import VoiceControlledAutomaton, State, Exit
+from automaton import VoiceControlledAutomaton, State, Exit, LazyAutomaton
 
-from music import JukeBox
-from wikidefine import WikiBot
-from gpt import GPTBot
-from chat import ChatBot
+# NOTE the sub automata (and GPTJ, revChatGPT, wikipedia behind them)
+# are imported on first use, see Hal9k.__init__
 
 # # TODO FIXME import these from their files after implementing
 # VC_GPT = ...
@@ -39,8 +39,10 @@ class Hal9k(VoiceControlledAutomaton):
     """
     def __init__(
             self,
+            prewarm: Union[bool, List[HalState]] = False,
             **kwargs
         ):
+        start = time.perf_counter()
         super().__init__(name="hal", **kwargs)
         # list of all possible keywords
         # (each keyword is a list of tokens)
@@ -81,22 +83,39 @@ class Hal9k(VoiceControlledAutomaton):
             HalState.define: self.respond_define,
         }
 
-        self.MP = JukeBox(
+        # sub automata are built on the first transition into their state
+        # (or by prewarming in the background)
+        self.MP = LazyAutomaton(
+            "music:JukeBox",
             _super=self,
             **kwargs
         )
-        self.WB = WikiBot(
+        self.WB = LazyAutomaton(
+            "wikidefine:WikiBot",
             _super=self,
             **kwargs
         )
-        self.GPT = GPTBot(
+        self.GPT = LazyAutomaton(
+            "gpt:GPTBot",
             _super=self,
             **kwargs
         )
-        self.Chat = ChatBot(
+        self.Chat = LazyAutomaton(
+            "chat:ChatBot",
             _super=self,
             **kwargs
         )
+        self.sub_automata: Dict[HalState, LazyAutomaton] = {
+            HalState.music: self.MP,
+            HalState.define: self.WB,
+            HalState.gpt: self.GPT,
+            HalState.chat: self.Chat,
+        }
+        self.init_time = time.perf_counter() - start
+
+        if prewarm:
+            states = list(self.sub_automata) if prewarm is True else prewarm
+            self.prewarm(states)
         # self.Weather = VC_Weather(
         #     **kwargs
         # )
@@ -107,6 +126,24 @@ class Hal9k(VoiceControlledAutomaton):
         #     **kwargs
         # )
 
+    def prewarm(self, states: List[HalState]) -> threading.Thread:
+        """Build the given sub automata on a background thread, so their first use is quick."""
+        def build():
+            for state in states:
+                try:
+                    self.sub_automata[state].prewarm()
+                except Exception as e:
+                    # will be retried (and raise) on first use
+                    self.logger.warning(f"prewarming {self.sub_automata[state]} failed: {e}")
+        thread = threading.Thread(target=build, name="hal-prewarm", daemon=True)
+        thread.start()
+        return thread
+
+    def startup_report(self) -> str:
+        lines = [f"{self} started in {self.init_time:.2f} s"]
+        lines += ["  " + sub.report() for sub in self.sub_automata.values()]
+        return "\n".join(lines)
+
     def _respond_waiting(self, text: str) -> HalState:
         greeting = random.choice([
             "Hi Marv.",
@@ -179,6 +216,7 @@ if __name__ == "__main__":
     GPIO.setwarnings(False)
     GPIO.setmode(GPIO.BCM)
 
-    hal = Hal9k()
+    hal = Hal9k(prewarm=True)
+    print(hal.startup_report())
     hal.run()
 
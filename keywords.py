@@ -1,7 +1,8 @@
-from typing import Union, Optional
+from typing import Callable, Dict, List, Union, Optional, Tuple
 from pathlib import Path
 import sys
 import os
+import math
 
 from matplotlib import pyplot as plt
 
@@ -11,11 +12,19 @@ import torchaudio
 
 
 import pytorch_lightning as pl
-from pytorch_lightning.callbacks import QuantizationAwareTraining
-from dataset import HAL_KW_DATASET
+from augment import Augment, load_noise
+from dataset import EXCEPT_FOLDER, HAL_KW_DATASET
+from kw_export import convert_qat, evaluate, export_artifact, prepare_qat, quantize_static, write_report
+from kw_runtime import configure_torch, score_windows, write_metadata
+from pcm import PCMFrame
+from resample import resample
+from resample_cache import ResampledDataset
+from buckets import BucketBatchSampler
+from shards import PackedDataset
 
 DATASET_PATH = "hal_keywords"
 BACKEND = "qnnpack"
+MODEL = "m5_2d" # see MODELS
 
 
 """
@@ -35,7 +44,12 @@ class HAL_KW(pl.LightningDataModule):
         pin_memory: Optional[bool] = None,
         batch_size: int = 128,
         sample_rate = 8000,
-
+        packed: bool = False,
+        cache: bool = True,
+        bucket: bool = True,
+        length: Optional[int] = None,
+        seed: int = 0,
+        augment: Union[bool, Augment] = False,
     ):
         super().__init__()
 
@@ -48,6 +62,18 @@ class HAL_KW(pl.LightningDataModule):
 
         self._dl_path = dl_path
         self._batch_size = batch_size
+        # read clips from int16 shards (python shards.py) instead of the WAV files
+        self._packed = packed
+        # resample every clip once into data/hal_keywords_cache and batch from there
+        self._cache = cache
+        # batch clips of similar length (buckets.BucketBatchSampler), shuffled reproducibly from seed
+        self._bucket = bucket
+        self._seed = seed
+        # fixed number of samples per clip (center crop / zero pad) instead of padding to the longest
+        self.length = length
+        # random noise/gain/shift/speed on training batches, in the loader workers (see augment.py);
+        # True: Augment defaults with the dataset's _background_noise_ clips
+        self._augment = augment
 
         if pin_memory is not None:
             self._pin_memory = pin_memory
@@ -60,6 +86,7 @@ class HAL_KW(pl.LightningDataModule):
             self._num_workers = 16 if self.device.type == "cuda" else 0
         self._train_dataset = None
         self._val_dataset = None
+        self._calibration_dataset = None
         self._labels = None
         self._label_to_index = None
         self.sample_rate = sample_rate
@@ -67,38 +94,36 @@ class HAL_KW(pl.LightningDataModule):
         self._input_sample_rate = None
 
     @staticmethod
-    def pad_sequence(batch):
-        # Make all tensor in a batch the same length by padding with zeros
-        batch = [item.t() for item in batch]
-        batch = torch.nn.utils.rnn.pad_sequence(batch, batch_first=True, padding_value=0.)
-        return batch.permute(0, 2, 1)
+    def pad_sequence(batch, length=None):
+        # Make all tensor in a batch the same length by padding with zeros,
+        # written straight into the (batch, channels, longest) result;
+        # with length, longer clips are cut around their middle
+        size = max(item.shape[-1] for item in batch) if length is None else length
+        out = batch[0].new_zeros(len(batch), batch[0].shape[0], size)
+        for i, item in enumerate(batch):
+            first = max(item.shape[-1] - size, 0) // 2
+            item = item[:, first:first + size]
+            out[i, :, :item.shape[-1]] = item
+        return out
 
     def transform(self, input, input_sample_rate=None):
         if input_sample_rate is None:
             if self._input_sample_rate is None:
                 _, self._input_sample_rate, *_ = self.train_dataset[0]
             input_sample_rate = self._input_sample_rate
-        # in TorchAudio master (0.9) there is a functional.resample
-        return torchaudio.transforms.Resample(orig_freq=input_sample_rate, new_freq=self.sample_rate)(input)
+        # cached polyphase filter bank, identical to the one used on live audio
+        return resample(input, input_sample_rate, self.sample_rate)
 
     def collate_fn(self, batch):
 
         # A data tuple has the form:
         # waveform, sample_rate, label, speaker_id, utterance_number
 
-        tensors, targets = [], []
-
-        # Gather in lists, and encode labels as indices
-        for waveform, input_sample_rate, label, *_ in batch:
-
-            tensors += [self.transform(waveform, input_sample_rate)]
-            targets += [self.label_to_index(label)]
-
-        # Group the list of tensors into a batched tensor
-        tensors = self.pad_sequence(tensors)
-        targets = torch.stack(targets)
-        self._label_to_index = None
-
+        # (only for datasets without cache, ResampledDataset batches itself)
+        label_to_index = self.train_dataset.label_to_index
+        tensors = self.pad_sequence([self.transform(waveform, input_sample_rate)
+            for waveform, input_sample_rate, *_ in batch], self.length)
+        targets = torch.tensor([label_to_index[label] for _, _, label, *_ in batch], dtype=torch.int64)
         return tensors, targets
 
     def prepare_data(self, download=False):
@@ -111,39 +136,81 @@ class HAL_KW(pl.LightningDataModule):
     def data_path(self):
         return Path(self._dl_path).joinpath(DATASET_PATH)
 
-    def __dataset(self, train: bool):
-        return HAL_KW_DATASET(root=self._dl_path,
-            subset="training" if train else "validation")
+    def __dataset(self, subset: str):
+        if self._packed:
+            dataset = PackedDataset(os.path.join(self._dl_path, DATASET_PATH + "_packed"), subset=subset)
+        else:
+            dataset = HAL_KW_DATASET(root=self._dl_path, subset=subset)
+        if self._cache:
+            dataset = ResampledDataset(dataset, self.sample_rate, os.path.join(self._dl_path, DATASET_PATH + "_cache"),
+                length=self.length)
+        return dataset
 
     @property
     def labels(self):
         if self._labels is None:
-            self._labels = sorted({os.path.basename(os.path.dirname(p)) for p in self.train_dataset._walker})
+            # from the dataset manifest, no directory walk
+            self._labels = self.train_dataset.labels
         return self._labels
 
+    @property
+    def augment(self) -> Optional[Augment]:
+        if self._augment is True:
+            noise = load_noise(os.path.join(self._dl_path, DATASET_PATH, EXCEPT_FOLDER), self.sample_rate)
+            if noise is None:
+                print(f"No {EXCEPT_FOLDER} clips, augmenting with white noise")
+            self._augment = Augment(self.sample_rate, noise=noise, seed=self._seed)
+        return self._augment or None
+
     @property
     def train_dataset(self):
         # note that we don't do any augmentation (randomness) here, so caching is OK
+        # (augment works on the batches)
         if self._train_dataset is None:
-            self._train_dataset = self.__dataset(train=True)
+            self._train_dataset = self.__dataset("training")
         return self._train_dataset
 
     @property
     def val_dataset(self):
         if self._val_dataset is None:
-            self._val_dataset = self.__dataset(train=False)
-        return self._train_dataset
+            self._val_dataset = self.__dataset("validation")
+        return self._val_dataset
 
-    def __dataloader(self, train: bool):
+    @property
+    def calibration_dataset(self):
+        # held out from training and validation: observes activation ranges for static quantization
+        if self._calibration_dataset is None:
+            self._calibration_dataset = self.__dataset("testing")
+        return self._calibration_dataset
+
+    def __dataloader(self, train: bool, dataset=None):
         """Train/validation loaders."""
+        if dataset is None:
+            dataset = self.train_dataset if train else self.val_dataset
+        if self._bucket and self.length is None:
+            # durations rather than sample counts, in case clips differ in sample rate
+            batch_sampler = BucketBatchSampler(dataset.num_samples / dataset.sample_rates, self._batch_size,
+                shuffle=train, drop_last=train, seed=self._seed)
+        else:
+            generator = torch.Generator().manual_seed(self._seed)
+            sampler = torch.utils.data.RandomSampler(dataset, generator=generator) if train \
+                else torch.utils.data.SequentialSampler(dataset)
+            batch_sampler = torch.utils.data.BatchSampler(sampler, self._batch_size, drop_last=train)
+        cached = isinstance(dataset, ResampledDataset)
+        # the cached dataset turns each index batch into a padded batch itself
+        collate_fn = None if cached else self.collate_fn
+        if train and self.augment is not None:
+            collate_fn = self.augment.collate(collate_fn)
         return torch.utils.data.DataLoader(
-            self.train_dataset if train else self.val_dataset,
-            batch_size=self._batch_size,
-            shuffle=train,
-            drop_last=train,
-            collate_fn=self.collate_fn,
+            dataset,
+            batch_size=None if cached else 1,
+            sampler=batch_sampler if cached else None,
+            batch_sampler=None if cached else batch_sampler,
+            collate_fn=collate_fn,
             pin_memory=self._pin_memory,
             num_workers=self._num_workers,
+            # worker seeds (and so the augmentation) follow seed
+            generator=torch.Generator().manual_seed(self._seed),
         )
 
     def train_dataloader(self):
@@ -152,9 +219,12 @@ class HAL_KW(pl.LightningDataModule):
     def val_dataloader(self):
         return self.__dataloader(train=False)
 
+    def calibration_dataloader(self):
+        return self.__dataloader(train=False, dataset=self.calibration_dataset)
+
     def label_to_index(self, word):
         if self._label_to_index is None:
-            self._label_to_index = {l: torch.tensor(idx) for idx, l in enumerate(self.labels)}
+            self._label_to_index = {l: torch.tensor(idx) for l, idx in self.train_dataset.label_to_index.items()}
         # Return the position of the word in labels, slow...
         return self._label_to_index[word]
 
@@ -163,6 +233,19 @@ class HAL_KW(pl.LightningDataModule):
         # This is the inverse of label_to_index
         return self.labels[index]
 
+# keyword model architectures by name; every entry is called as
+# model_class(n_input=..., n_output=...) and maps (batch, 2, time) input to class scores
+MODELS: Dict[str, Callable[..., nn.Module]] = {}
+
+
+def register_model(name: str):
+    def register(model_class):
+        MODELS[name] = model_class
+        return model_class
+    return register
+
+
+@register_model("m5_2d")
 class M5_2d(torch.nn.Sequential):
     def __init__(self, n_input=2, n_output=10, stride=16, n_channel=32):
         super().__init__(
@@ -188,17 +271,223 @@ class M5_2d(torch.nn.Sequential):
             torch.nn.Linear(2 * n_channel, n_output),
         )
 
+def mel_filterbank(n_freqs: int, n_mels: int, sample_rate: int, f_min: float = 20., f_max: Optional[float] = None) -> torch.Tensor:
+    """(n_freqs, n_mels) triangular HTK mel filters, like torchaudio.functional.melscale_fbanks"""
+    f_max = f_max if f_max is not None else sample_rate / 2
+    mel = lambda f: 2595. * math.log10(1. + f / 700.)
+    m_pts = torch.linspace(mel(f_min), mel(f_max), n_mels + 2, dtype=torch.float64)
+    f_pts = 700. * (10 ** (m_pts / 2595.) - 1.)
+    freqs = torch.linspace(0, sample_rate / 2, n_freqs, dtype=torch.float64)
+    slopes = f_pts[None, :] - freqs[:, None] # (n_freqs, n_mels + 2)
+    f_diff = f_pts[1:] - f_pts[:-1]
+    down = -slopes[:, :-2] / f_diff[:-1]
+    up = slopes[:, 2:] / f_diff[1:]
+    return torch.clamp(torch.min(down, up), min=0.).to(torch.float32)
+
+
+class LogMel(nn.Module):
+    """
+    (batch, channels, time) waveform -> (batch, 1, n_mels or n_mfcc, frames) log mel / MFCC features.
+
+    Hann window, mel filterbank and DCT are precomputed buffers; what is left per
+    window is one FFT per frame and two small matmuls.
+    It always runs in float, also inside a statically quantized model.
+    """
+    def __init__(self, sample_rate: int = 8000, n_fft: int = 256, hop: int = 160, n_mels: int = 40,
+            n_mfcc: Optional[int] = None):
+        super().__init__()
+        self.n_fft = n_fft
+        self.hop = hop
+        n_freqs = n_fft // 2 + 1
+        self.register_buffer("window", torch.hann_window(n_fft))
+        self.register_buffer("mel", mel_filterbank(n_freqs, n_mels, sample_rate).t().contiguous())
+        if n_mfcc is not None:
+            # orthonormal DCT-II over the mel bins
+            k = torch.arange(n_mfcc, dtype=torch.float64)[:, None]
+            n = torch.arange(n_mels, dtype=torch.float64)[None, :]
+            dct = torch.cos(math.pi / n_mels * (n + .5) * k) * math.sqrt(2. / n_mels)
+            dct[0] /= math.sqrt(2.)
+            self.register_buffer("dct", dct.to(torch.float32))
+        else:
+            self.register_buffer("dct", torch.zeros(0, n_mels))
+        self.n_features = n_mfcc if n_mfcc is not None else n_mels
+        self.dequant = torch.quantization.DeQuantStub()
+        self.quant = torch.quantization.QuantStub()
+
+    def frames(self, length: int) -> int:
+        return (length - self.n_fft) // self.hop + 1
+
+    def macs(self, length: int) -> int:
+        """multiply-accumulates for one input of length samples (radix 2 FFT estimate)"""
+        n_mels, n_freqs = self.mel.shape
+        fft = 2 * self.n_fft * int(math.log2(self.n_fft))
+        per_frame = self.n_fft + fft + n_freqs + n_mels * n_freqs + self.dct.shape[0] * n_mels
+        return self.frames(length) * per_frame
+
+    def forward(self, x: torch.Tensor) -> torch.Tensor:
+        x = self.dequant(x).mean(dim=1) # stereo rows carry the same mono signal
+        # real/imaginary pairs instead of a complex tensor, which the ONNX exporter can't handle
+        spec = torch.stft(x, self.n_fft, self.hop, window=self.window, center=False, return_complex=False)
+        power = spec.pow(2).sum(dim=-1) # (batch, n_freqs, frames)
+        features = torch.log(torch.matmul(self.mel, power) + 1e-6)
+        if self.dct.shape[0] > 0:
+            features = torch.matmul(self.dct, features)
+        return self.quant(features.unsqueeze(1))
+
+
+@register_model("dscnn")
+class DSCNN(torch.nn.Sequential):
+    """
+    MFCC (or log mel) front end + depthwise separable CNN, after DS-CNN-S of
+    "Hello Edge" (Zhang et al. 2017): one strided regular conv, then blocks of
+    depthwise 3x3 and pointwise 1x1 conv, each followed by batch norm and relu
+    (fusable for quantization like M5_2d's).
+    """
+    def __init__(self, n_input=2, n_output=10, n_channel=32, n_blocks=4, sample_rate=8000, n_mels=40, n_mfcc=10):
+        layers = [
+            LogMel(sample_rate=sample_rate, n_mels=n_mels, n_mfcc=n_mfcc),
+            torch.nn.Conv2d(1, n_channel, kernel_size=(4, 10), stride=2, padding=(1, 4), bias=False),
+            torch.nn.BatchNorm2d(n_channel),
+            torch.nn.ReLU(),
+        ]
+        for _ in range(n_blocks):
+            layers += [
+                torch.nn.Conv2d(n_channel, n_channel, kernel_size=3, padding=1, groups=n_channel, bias=False),
+                torch.nn.BatchNorm2d(n_channel),
+                torch.nn.ReLU(),
+                torch.nn.Conv2d(n_channel, n_channel, kernel_size=1, bias=False),
+                torch.nn.BatchNorm2d(n_channel),
+                torch.nn.ReLU(),
+            ]
+        layers += [
+            torch.nn.AdaptiveAvgPool2d(1),
+            torch.nn.Flatten(),
+            torch.nn.Linear(n_channel, n_output),
+        ]
+        super().__init__(*layers)
+
+
+@register_model("logmel_dscnn")
+def LogMelDSCNN(n_input=2, n_output=10, **kwargs):
+    # 40 log mel bands instead of 10 MFCCs, fewer channels to stay within M5_2d's budget
+    kwargs.setdefault("n_channel", 24)
+    return DSCNN(n_input=n_input, n_output=n_output, n_mels=40, n_mfcc=None, **kwargs)
+
+
+def count_macs(model: nn.Module, window: int = 8000) -> int:
+    """multiply-accumulates of one forward pass on a (1, 2, window) input"""
+    macs = []
+
+    def conv_hook(module, inp, out):
+        kernel = module.weight[0].numel() # in_channels / groups * kernel area
+        macs.append(out.numel() * kernel)
+
+    def linear_hook(module, inp, out):
+        macs.append(module.in_features * module.out_features)
+
+    hooks = []
+    for module in model.modules():
+        if isinstance(module, (nn.Conv1d, nn.Conv2d)):
+            hooks.append(module.register_forward_hook(conv_hook))
+        elif isinstance(module, nn.Linear):
+            hooks.append(module.register_forward_hook(linear_hook))
+        elif isinstance(module, LogMel):
+            macs.append(module.macs(window))
+    with torch.no_grad():
+        model.eval()(torch.zeros(1, 2, window))
+    for hook in hooks:
+        hook.remove()
+    return sum(macs)
+
+
+def receptive_field(layers) -> Tuple[int, int]:
+    """(receptive field, stride) in input samples of a stack of (1, k) convs/pools along time."""
+    field, stride = 1, 1
+    for layer in layers:
+        if isinstance(layer, (nn.Conv2d, nn.MaxPool2d)):
+            kernel = layer.kernel_size[-1] if isinstance(layer.kernel_size, tuple) else layer.kernel_size
+            step = layer.stride[-1] if isinstance(layer.stride, tuple) else layer.stride
+            field += (kernel - 1) * stride
+            stride *= step
+    return field, stride
+
+
+class StreamingM5_2d(nn.Module):
+    """
+    Streaming version of a trained M5_2d for a sliding window of window samples
+    that advances by hop samples per call.
+
+    The layers up to the deepest max pool whose total stride divides hop
+    (the "front") only run on the newly arrived samples; their output frames
+    are cached for the whole window. The rest of the network ("back") runs on
+    the cached frames. After prime(first window), every forward(next hop)
+    matches the batch model on the last window samples (eval mode).
+    """
+    def __init__(self, model: M5_2d, window: int = 8000, hop: int = 448):
+        super().__init__()
+        layers = list(model)
+        cut = 0
+        for i, layer in enumerate(layers):
+            if isinstance(layer, nn.MaxPool2d) and hop % receptive_field(layers[:i+1])[1] == 0:
+                cut = i + 1
+        assert cut > 0, f"hop={hop} must be a multiple of the first pooling stride {receptive_field(layers[:5])[1]}"
+
+        self.front = nn.Sequential(*layers[:cut])
+        self.back = nn.Sequential(*layers[cut:])
+        self.window = window
+        self.hop = hop
+        self.field, self.stride = receptive_field(layers[:cut])
+        self.frames = (window - self.field) // self.stride + 1
+        channels = [l.out_channels for l in layers[:cut] if isinstance(l, nn.Conv2d)][-1]
+        rows = 2 # stereo rows, see M5_2d's Unflatten
+        self.register_buffer("tail", torch.zeros(1, rows, 0))
+        self.register_buffer("cache", torch.zeros(1, channels, 1, self.frames).repeat(1, 1, rows, 1))
+
+    @torch.jit.export
+    def reset(self):
+        self.tail = self.tail[..., :0]
+        self.cache = torch.zeros_like(self.cache)
+
+    def _advance(self, x: torch.Tensor) -> torch.Tensor:
+        # run the front on tail + x, keep what the next frames still need
+        buf = torch.cat([self.tail, x], dim=-1)
+        n = (buf.shape[-1] - self.field) // self.stride + 1
+        if n <= 0:
+            self.tail = buf
+            return self.cache[..., :0]
+        out = self.front(buf[..., :(n - 1) * self.stride + self.field])
+        self.tail = buf[..., n * self.stride:]
+        return out
+
+    @torch.jit.export
+    def prime(self, window: torch.Tensor) -> torch.Tensor:
+        """Start a stream from a full (1, 2, window) input; returns the batch model's output on it."""
+        self.reset()
+        self.cache = self._advance(window)[..., -self.frames:]
+        return self.back(self.cache)
+
+    def forward(self, x: torch.Tensor) -> torch.Tensor:
+        """x: the next (1, 2, hop) samples; returns scores for the window ending with them."""
+        out = self._advance(x)
+        self.cache = torch.cat([self.cache[..., out.shape[-1]:], out], dim=-1)
+        return self.back(self.cache)
+
+
 class KeywordModel(pl.LightningModule):
     def __init__(
             self,
-            model_class: nn.Module=M5_2d,
-            dm: pl.LightningDataModule=HAL_KW(),
+            model_class: Union[str, Callable[..., nn.Module]]=M5_2d,
+            dm: Optional[pl.LightningDataModule]=None,
             model=None,
             model_path: str= None
         ):
 
         # n_input = 1 for mono, 2 for stereo
         super().__init__()
+        if dm is None:
+            dm = HAL_KW()
+        if isinstance(model_class, str):
+            model_class = MODELS[model_class]
         if model is not None:
             self.model = model
         else:
@@ -216,9 +505,27 @@ class KeywordModel(pl.LightningModule):
         self.sample_rate = dm.sample_rate
 
     def forward(self, x):
-        print(x.shape)
         return self.model(x)
 
+    def infer(self, frame: PCMFrame) -> torch.Tensor:
+        """Class scores for a single PCM frame at self.sample_rate."""
+        assert frame.sample_rate == self.sample_rate, \
+            f"model expects {self.sample_rate} Hz audio, got {frame.sample_rate} Hz"
+        # trained on stereo input; mono is broadcast to both channels without copying
+        x = frame.to_tensor().expand(2, -1).unsqueeze(0)
+        with torch.no_grad():
+            return self(x)
+
+    def score_windows(self, signal: torch.Tensor, window: int, step: int, reduce: str = "max") -> torch.Tensor:
+        """see kw_runtime.score_windows"""
+        return score_windows(self, signal, window, step, reduce)
+
+    def streaming(self, window: Optional[int] = None, hop: int = 448) -> StreamingM5_2d:
+        """Streaming copy of the (trained) model; window defaults to one second."""
+        window = window if window is not None else self.sample_rate
+        assert isinstance(self.model, M5_2d), "streaming inference is only implemented for M5_2d"
+        return StreamingM5_2d(self.model, window, hop).eval()
+
     def training_step(self, batch, batch_idx):
         inp, label = batch
         pred = self(inp)
@@ -249,6 +556,7 @@ def main():
     n_gpus = 1 if torch.cuda.is_available() else 0
     print(device)
     models = "models/"
+    configure_torch(BACKEND, num_threads=None, interop_threads=None)
 
     # DATASET PREPARATION
     dm = HAL_KW(dl_path='data', num_workers=4)
@@ -263,67 +571,97 @@ def main():
     # assert False
 
     # FP32 MODEL INITIALIZATION
-    # (use 2d architecture here already)
-    model = KeywordModel(dm=dm)
+    # (use 2d architecture here already, or any other registered in MODELS)
+    model = KeywordModel(model_class=MODEL, dm=dm)
 
     # FP32 TRAINING
     trainer = pl.Trainer(gpus=n_gpus, max_epochs=2, check_val_every_n_epoch=1)  # for real training, I use 40 epochs or so
     trainer.fit(model, datamodule=dm)
-    print(model.val_accuracy.compute().item())
-    torch.jit.save(model.to_torchscript(), models+'audio_model_fp32.pt')
-
-    # QUANTIZATION PREPARATIONS
-    layers_to_fuse = []
-    for i in range(len(model.model) - 2):
-        if (isinstance(model.model[i], torch.nn.Conv2d) and
-            isinstance(model.model[i + 1], torch.nn.BatchNorm2d) and
-            isinstance(model.model[i + 2], torch.nn.ReLU)):
-            layers_to_fuse.append([f'model.{ii}' for ii in [i, i + 1, i + 2]])
-    print(layers_to_fuse)
-
-    # QAT
-    qmodel = KeywordModel(dm=dm)
-    # for real training, t-vi uses 40 epochs or so instead of just 2
-    qtrainer = pl.Trainer(gpus=n_gpus, max_epochs=1, check_val_every_n_epoch=1, callbacks=[QuantizationAwareTraining(qconfig=BACKEND, modules_to_fuse=layers_to_fuse)])
+    print("fp32 val acc:", model.val_accuracy.compute().item())
+    fp32 = model.model.cpu().eval()
+
+    # PTQ: static quantization, calibrated on the held-out split
+    print("Calibrating statically quantized model")
+    ptq = quantize_static(fp32, dm.calibration_dataloader(), BACKEND)
 
+    # QAT: fused fake quantized copy of the fp32 model, trained further
+    qmodel = KeywordModel(dm=dm, model=prepare_qat(fp32, BACKEND))
+    # for real training, t-vi uses 40 epochs or so instead of just 2
+    qtrainer = pl.Trainer(gpus=n_gpus, max_epochs=1, check_val_every_n_epoch=1)
     print("Fitting quantization aware model")
     qtrainer.fit(qmodel, datamodule=dm)
-    print("QAT val acc:", model.val_accuracy.compute().item())
-
-    # torch script saving
-    smodel = model.to_torchscript()
-    torch.jit.save(smodel, models+'audio_model_int8.pt')
-    print("Validating quantized model:")
-    trainer.validate(model)
-
-
-def benchmark():
-    # raspberry pi testing part from bottom of notebook
-    import torch.utils.benchmark
+    print("QAT val acc:", qmodel.val_accuracy.compute().item())
+    qat = convert_qat(qmodel.model)
+
+    # EXPORT: artifacts, sidecars and the report, measured single threaded like on the pi
+    configure_torch(BACKEND, num_threads=1, interop_threads=None)
+    val = list(dm.val_dataloader())
+    artifacts = {
+        "fp32": export_artifact(fp32, models+'audio_model_fp32.pt', dm.labels, dm.sample_rate, val, model=MODEL),
+        "int8_ptq": export_artifact(ptq, models+'audio_model_int8_ptq.pt', dm.labels, dm.sample_rate, val, model=MODEL),
+        "int8_qat": export_artifact(qat, models+'audio_model_int8_qat.pt', dm.labels, dm.sample_rate, val, model=MODEL),
+    }
+    # the assistant looks for audio_model_int8.pt: the more accurate of the two
+    best = max(["int8_ptq", "int8_qat"], key=lambda name: artifacts[name]["accuracy"])
+    print(f"Using {best} as int8 model")
+    int8 = ptq if best == "int8_ptq" else qat
+    artifacts["int8"] = export_artifact(int8, models+'audio_model_int8.pt', dm.labels, dm.sample_rate, val,
+        model=MODEL, method=best)
+
+    if isinstance(model.model, M5_2d):
+        streaming = model.streaming()
+        torch.jit.save(torch.jit.script(streaming), models+'audio_model_streaming.pt')
+        write_metadata(models+'audio_model_streaming.pt', dm.labels, dm.sample_rate, hop=streaming.hop)
+
+    write_report(models+'export_report.json', artifacts, BACKEND,
+        calibration_clips=len(dm.calibration_dataset), validation_clips=len(dm.val_dataset))
+
+
+def compare(names: Optional[List[str]] = None, max_epochs: int = 2, models: str = "models/") -> Dict[str, dict]:
+    """
+    Train each registered architecture (default: all) with the same loop and data,
+    export it and report accuracy, MACs, parameters, size and single threaded latency
+    to models/model_comparison.json. Latency is measured on this machine; for pi numbers
+    copy the artifacts over and let select_runtime time them there.
+    """
+    names = names if names else list(MODELS)
+    n_gpus = 1 if torch.cuda.is_available() else 0
+    configure_torch(BACKEND, num_threads=None, interop_threads=None)
+    threads = torch.get_num_threads()
+    dm = HAL_KW(dl_path='data', num_workers=4)
+    val = list(dm.val_dataloader())
 
-    models_dir =  "./models/"
+    results = {}
+    for name in names:
+        print(f"Training {name}")
+        model = KeywordModel(model_class=name, dm=dm)
+        trainer = pl.Trainer(gpus=n_gpus, max_epochs=max_epochs, check_val_every_n_epoch=1)
+        trainer.fit(model, datamodule=dm)
+        net = model.model.cpu().eval()
 
-    # torch.backends.quantized.engine = 'qnnpack'
-    torch.backends.quantized.engine = BACKEND
+        torch.set_num_threads(1)
+        entry = export_artifact(net, models+f'audio_model_{name}.pt', dm.labels, dm.sample_rate, val, model=name)
+        torch.set_num_threads(threads)
+        entry["macs"] = count_macs(net, dm.sample_rate)
+        entry["parameters"] = sum(p.numel() for p in net.parameters())
+        print(f"{name}: {entry['macs'] / 1e6:.1f} M MACs, {entry['parameters']} parameters")
+        results[name] = entry
 
-    fp_model = torch.jit.load(models_dir+'audio_model_fp32.pt', map_location='cpu')
-    q_model = torch.jit.load(models_dir+'audio_model_int8.pt', map_location='cpu')
+    write_report(models+'model_comparison.json', results, BACKEND, max_epochs=max_epochs)
+    return results
 
-    inp = torch.randn(1, 1, 8000)
 
-    tf = torch.utils.benchmark.Timer(
-        setup='from __main__ import fp_model, inp',
-        stmt='fp_model(inp)'
-    )
-    # due to the way PyTorch computes warmup, use >= 200 here to get at least two warmup steps
-    print(f"fp32 {tf.timeit(200).median * 1000:.1f} ms")
+def benchmark():
+    # quick fp32 vs int8 comparison, see kw_bench.py for the full matrix
+    from kw_bench import run
 
-    tq = torch.utils.benchmark.Timer(
-        setup='from __main__ import q_model, inp',
-        stmt='q_model(q_model.quant(inp))'
-    )
-    print(f"int8 {tq.timeit(200).median * 1000:.1f} ms")
+    models_dir =  "./models/"
+    run([models_dir+'audio_model_fp32.pt', models_dir+'audio_model_int8.pt'], backend=BACKEND)
 
 if __name__ == "__main__":
-    main()
-    benchmark()
+    if sys.argv[1:2] == ["compare"]:
+        # python keywords.py compare [model names ...]
+        compare(sys.argv[2:])
+    else:
+        main()
+        benchmark()
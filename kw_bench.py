@@ -0,0 +1,189 @@
+from typing import Dict, List, Optional, Sequence
+import argparse
+import datetime
+import glob
+import json
+import multiprocessing as mp
+import os
+import platform
+import resource
+import subprocess
+import time
+
+import numpy as np
+import torch
+
+from kw_runtime import KeywordRuntime, configure_torch
+
+__all__ = ["benchmark_artifact", "run", "main"]
+
+"""
+Latency benchmark matrix for exported keyword models:
+
+    python kw_bench.py models/*.pt models/*.onnx --batch-sizes 1 8 --windows-ms 1000 1500 --threads 1 2 4 \
+        --label pi4 --output bench.json
+
+Every artifact (fp32, int8, streaming, mobile, ONNX, ...) is benchmarked in a
+fresh process, so the reported peak RSS is that artifact's own, over all
+combinations of batch size, window length and thread count. Streaming
+artifacts (sidecar with "hop") are timed per hop after priming, batch size 1
+and their own window only. The JSON output carries host, torch and git commit
+so files from different pis and commits can be compared.
+"""
+
+
+def _peak_rss_mb() -> float:
+    # ru_maxrss is in KiB on linux, bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / 1024 ** 2 if platform.system() == "Darwin" else rss / 1024
+
+
+def _time(fn, runs: int, warmup: int) -> np.ndarray:
+    for _ in range(warmup):
+        fn()
+    times = np.empty(runs)
+    for i in range(runs):
+        start = time.perf_counter()
+        fn()
+        times[i] = time.perf_counter() - start
+    return times
+
+
+def benchmark_artifact(
+        path: str,
+        batch_sizes: Sequence[int] = (1,),
+        windows_ms: Sequence[Optional[float]] = (None,),
+        threads: Sequence[int] = (1,),
+        runs: int = 200,
+        warmup: int = 20,
+        backend: Optional[str] = None,
+    ) -> List[Dict[str, object]]:
+    """one result per (threads, batch size, window) combination; window None is the artifact's own"""
+    configure_torch(backend, num_threads=threads[0], interop_threads=1)
+    runtime = KeywordRuntime.load(path)
+    streaming = "hop" in runtime.meta
+    results = []
+    for num_threads in threads:
+        torch.set_num_threads(num_threads)
+        for batch in ([1] if streaming else batch_sizes):
+            for window_ms in ([None] if streaming else windows_ms):
+                window = runtime.window if window_ms is None else int(round(runtime.sample_rate * window_ms / 1000))
+                result = {
+                    "artifact": path,
+                    "format": runtime.format,
+                    "streaming": streaming,
+                    "threads": num_threads,
+                    "batch": batch,
+                    "window_ms": window * 1000 / runtime.sample_rate,
+                    "runs": runs,
+                }
+                try:
+                    if streaming:
+                        # one call advances the window by one hop
+                        hop = int(runtime.meta["hop"])
+                        with torch.no_grad():
+                            runtime.module.prime(torch.zeros(1, 2, window))
+                        x = torch.zeros(1, 2, hop)
+                        step = lambda: runtime(x)
+                        audio_seconds = hop / runtime.sample_rate
+                    else:
+                        x = torch.randn(batch, 2, window) * .1
+                        step = lambda: runtime(x)
+                        audio_seconds = window / runtime.sample_rate
+                    times = _time(step, runs, warmup)
+                except Exception as e:
+                    result["error"] = str(e).splitlines()[0]
+                    print(f"{path} threads={num_threads} batch={batch} window={window}: {result['error']}")
+                    results.append(result)
+                    continue
+                p50, p95, p99 = (float(p) for p in np.percentile(times, [50, 95, 99]) * 1000)
+                mean = float(times.mean())
+                result.update({
+                    "p50_ms": p50,
+                    "p95_ms": p95,
+                    "p99_ms": p99,
+                    "mean_ms": mean * 1000,
+                    "windows_per_s": batch / mean,
+                    # seconds of (new) audio processed per second of compute
+                    "realtime_factor": batch * audio_seconds / mean,
+                })
+                print(f"{path} threads={num_threads} batch={batch} window={result['window_ms']:.0f}ms: "
+                    f"p50 {p50:.2f} p95 {p95:.2f} p99 {p99:.2f} ms, {result['windows_per_s']:.0f} windows/s")
+                results.append(result)
+    rss = _peak_rss_mb()
+    for result in results:
+        result["peak_rss_mb"] = rss
+    return results
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)))
+        return out.stdout.strip() or None
+    except OSError:
+        return None
+
+
+def run(
+        paths: Sequence[str],
+        batch_sizes: Sequence[int] = (1,),
+        windows_ms: Sequence[Optional[float]] = (None,),
+        threads: Sequence[int] = (1,),
+        runs: int = 200,
+        warmup: int = 20,
+        backend: Optional[str] = None,
+        label: Optional[str] = None,
+        output: Optional[str] = None,
+    ) -> Dict[str, object]:
+    """benchmark every artifact in its own spawned process, optionally write the JSON report to output"""
+    ctx = mp.get_context("spawn")
+    results = []
+    for path in paths:
+        with ctx.Pool(1) as pool:
+            try:
+                results += pool.apply(benchmark_artifact, (path, batch_sizes, windows_ms, threads, runs, warmup, backend))
+            except Exception as e:
+                print(f"Skipping {path}: {e}")
+                results.append({"artifact": path, "error": str(e).splitlines()[0]})
+    report = {
+        "label": label,
+        "host": platform.node(),
+        "machine": platform.machine(),
+        "processor": platform.processor(),
+        "cpus": os.cpu_count(),
+        "python": platform.python_version(),
+        "torch": torch.__version__,
+        "quantized_engine": configure_torch(backend, num_threads=None, interop_threads=None),
+        "commit": _git_commit(),
+        "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+        "results": results,
+    }
+    if output is not None:
+        with open(output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Wrote benchmark results to {output}")
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Latency benchmark matrix for exported keyword models")
+    parser.add_argument("paths", nargs="*", help="artifacts with sidecars, default: models/*.pt and models/*.onnx")
+    parser.add_argument("--batch-sizes", nargs="+", type=int, default=[1])
+    parser.add_argument("--windows-ms", nargs="+", type=float, default=None,
+        help="input lengths, default: each artifact's own window")
+    parser.add_argument("--threads", nargs="+", type=int, default=[1])
+    parser.add_argument("--runs", type=int, default=200)
+    parser.add_argument("--warmup", type=int, default=20)
+    parser.add_argument("--backend", default=None, help="quantized engine, default depends on the cpu")
+    parser.add_argument("--label", default=None, help="free form tag stored in the report, e.g. the pi's name")
+    parser.add_argument("--output", default=None, help="JSON report path")
+    args = parser.parse_args()
+
+    paths = args.paths or sorted(glob.glob("models/*.pt") + glob.glob("models/*.onnx"))
+    run(paths, args.batch_sizes, args.windows_ms or [None], args.threads, args.runs, args.warmup,
+        args.backend, args.label, args.output)
+
+
+if __name__ == "__main__":
+    main()
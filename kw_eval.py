@@ -0,0 +1,364 @@
+from typing import Dict, List, Optional, Sequence, Tuple
+import argparse
+import glob
+import json
+import multiprocessing as mp
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+import speech_recognition as sr
+
+from cascade import KeywordCascade, KeywordDecision
+from custom_recognizer import CustomRecognizer
+from kw_runtime import KeywordRuntime, configure_torch
+from replay import load_wav
+
+__all__ = ["ArraySource", "build_stream", "detect", "score", "evaluate", "main"]
+
+"""
+False accept / false reject evaluation of the wake word detector on long recordings:
+
+    python kw_eval.py models/audio_model_fp32.pt --background noise/*.wav --hours 4 \
+        --thresholds 0.5 0.7 0.9 0.95 --output kw_eval.json
+
+Background audio (default: data/hal_keywords/_background_noise_/*.wav, white
+noise if there is none) is looped to the requested length and keyword clips
+(default: the testing list) are mixed in at random positions. The stream is
+cut into segments which worker processes run through the real
+CustomRecognizer.wait_for_keyword, unpaced, once per threshold; after every
+detection the detector restarts refractory_s later, like after a turn on the
+device. Thresholds apply to posteriors smoothed over --smoothing checks
+(cascade.KeywordDecision). Detections are matched against the mixed in clips:
+
+    false_accepts_per_hour  detections outside any clip (or of the wrong class), per hour of stream
+    miss_rate               clips without a detection of their class
+    delay_s                 detection (end of the detected window) minus end of the clip
+"""
+
+DEFAULT_BACKGROUND = "data/hal_keywords/_background_noise_/*.wav"
+
+# per worker process, see _init_worker
+_runtime: Optional[KeywordRuntime] = None
+_stream: Optional[np.ndarray] = None
+_options: Dict[str, object] = {}
+
+
+class ArraySource(sr.AudioSource):
+    """AudioSource reading int16 mono samples from memory as fast as they are read"""
+    def __init__(self, samples: np.ndarray, sample_rate: int, chunk_size: int = 1024):
+        self.SAMPLE_RATE = sample_rate
+        self.SAMPLE_WIDTH = 2
+        self.CHUNK = chunk_size
+        self.format = None
+        self.stream = ArraySource.ArrayStream(samples)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return
+
+    class ArrayStream(object):
+        def __init__(self, samples: np.ndarray):
+            self.samples = samples
+            self.position = 0
+
+        def read(self, size):
+            chunk = self.samples[self.position:self.position + size]
+            self.position += len(chunk)
+            return np.ascontiguousarray(chunk, dtype=np.int16).tobytes()
+
+        def close(self):
+            return
+
+
+def build_stream(
+        path: str,
+        background: Sequence[str],
+        clips: Sequence[str],
+        hours: float,
+        every_s: float = 30.,
+        sample_rate: int = 16000,
+        keyword_gain_db: float = 0.,
+        noise_dbfs: float = -60.,
+        seed: int = 0,
+    ) -> List[Dict[str, object]]:
+    """
+    Write hours of int16 background audio with keyword clips mixed in about every every_s
+    seconds to the .npy file at path (memory mapped, so long streams need not fit in memory).
+    Returns the mixed in clips: path, label, start and end sample.
+    """
+    rng = np.random.default_rng(seed)
+    n = int(hours * 3600 * sample_rate)
+    stream = np.lib.format.open_memmap(path, mode="w+", dtype=np.int16, shape=(n,))
+
+    noise = [np.frombuffer(load_wav(p, sample_rate), dtype=np.int16) for p in background]
+    noise = [x for x in noise if len(x)]
+    if noise:
+        position = 0
+        while position < n:
+            for i in rng.permutation(len(noise)):
+                m = min(len(noise[i]), n - position)
+                stream[position:position + m] = noise[i][:m]
+                position += m
+                if position >= n:
+                    break
+    else:
+        print(f"No background audio, using white noise at {noise_dbfs} dBFS")
+        scale = 32768 * 10 ** (noise_dbfs / 20)
+        block = 60 * sample_rate
+        for position in range(0, n, block):
+            m = min(block, n - position)
+            stream[position:position + m] = np.clip(rng.normal(0, scale, m), -32768, 32767)
+
+    gain = 10 ** (keyword_gain_db / 20)
+    keywords = [(p, np.frombuffer(load_wav(p, sample_rate), dtype=np.int16)) for p in clips]
+    events = []
+    position = int(every_s * rng.uniform(.5, 1.5) * sample_rate)
+    while keywords and position < n:
+        clip_path, clip = keywords[rng.integers(len(keywords))]
+        end = position + len(clip)
+        if end > n:
+            break
+        mixed = stream[position:end].astype(np.int32) + (clip * gain).astype(np.int32)
+        stream[position:end] = np.clip(mixed, -32768, 32767)
+        # labelled by their directory, like the dataset
+        events.append({"path": clip_path, "label": os.path.basename(os.path.dirname(os.path.abspath(clip_path))),
+            "start": position, "end": end})
+        position = end + int(every_s * rng.uniform(.5, 1.5) * sample_rate)
+    stream.flush()
+    return events
+
+
+def _init_worker(stream_path: str, model_path: str, backend: Optional[str], options: Dict[str, object]):
+    global _runtime, _stream, _options
+    configure_torch(backend, num_threads=1)
+    _runtime = KeywordRuntime.load(model_path)
+    _stream = np.load(stream_path, mmap_mode="r")
+    _options = options
+    # wait_for_keyword reports every detection on stdout
+    sys.stdout = open(os.devnull, "w")
+
+
+def detect(
+        samples: np.ndarray,
+        sample_rate: int,
+        keyword_model,
+        threshold: float,
+        start: int = 0,
+        stop: Optional[int] = None,
+        window_ms: float = 1000,
+        hop_ms: float = 50,
+        energy_threshold: Optional[float] = None,
+        refractory_s: float = 2.,
+        chunk_s: float = 60.,
+        smoothing: int = 3,
+    ) -> List[Tuple[int, int, float]]:
+    """
+    (end sample, class, smoothed posterior) of every detection of windows ending in samples[start:stop],
+    found by CustomRecognizer.wait_for_keyword. The samples are fed chunk_s at a time, with
+    every_hop backpressure and a ring holding a whole chunk, so no window is skipped.
+    energy_threshold None runs the model on every hop (no energy gate).
+    """
+    stop = len(samples) if stop is None else stop
+    recognizer = CustomRecognizer(
+        keyword_window_ms=window_ms,
+        keyword_hop_ms=hop_ms,
+        keyword_max_lag_ms=chunk_s * 1000 + window_ms,
+        keyword_backpressure="every_hop",
+        keyword_cascade=KeywordCascade(gate=energy_threshold is not None),
+        keyword_decision=KeywordDecision(threshold=threshold, smoothing=smoothing),
+    )
+    if energy_threshold is not None:
+        recognizer.energy_threshold = energy_threshold
+    stats = recognizer.keyword_stats
+    ratio = sample_rate / keyword_model.sample_rate
+    span = int(round(window_ms * sample_rate / 1000))
+    chunk = max(int(chunk_s * sample_rate), 4 * span)
+
+    detections = []
+    # the first window ends at start
+    position = max(0, start - span)
+    while position + span <= stop:
+        end = min(stop, position + chunk)
+        detected = stats.detections
+        recognizer.wait_for_keyword(ArraySource(samples[position:end], sample_rate), keyword_model)
+        if stats.detections > detected:
+            window_end, keyword_result, posterior = stats.last_detection
+            at = position + int(round(window_end * ratio))
+            detections.append((at, keyword_result, posterior))
+            position = at + int(refractory_s * sample_rate) - span
+        elif end >= stop:
+            break
+        else:
+            # go on with the window ending where this chunk ended
+            position = end - span
+    return detections
+
+
+def _detect_segment(task):
+    threshold, start, stop = task
+    return threshold, detect(_stream, _options["sample_rate"], _runtime, threshold, start, stop,
+        _options["window_ms"], _options["hop_ms"], _options["energy_threshold"], _options["refractory_s"],
+        smoothing=_options["smoothing"])
+
+
+def score(
+        detections: Sequence[Tuple[int, int, float]],
+        events: Sequence[Dict[str, object]],
+        labels: Sequence[str],
+        n_samples: int,
+        sample_rate: int,
+        tolerance_s: float = 1.,
+    ) -> Dict[str, object]:
+    """false accepts per hour, miss rate (overall and per label) and detection delay of one detection run"""
+    tolerance = int(tolerance_s * sample_rate)
+    starts = np.array([e["start"] for e in events], dtype=np.int64)
+    hit = [False] * len(events)
+    delays = []
+    false_accepts = wrong_class = 0
+    for at, keyword_result, _ in sorted(detections):
+        # latest clip starting before the detection, if it is still within tolerance
+        i = int(np.searchsorted(starts, at, side="right")) - 1
+        if i >= 0 and at <= events[i]["end"] + tolerance:
+            if labels[keyword_result] == events[i]["label"]:
+                if not hit[i]:
+                    hit[i] = True
+                    delays.append((at - events[i]["end"]) / sample_rate)
+                continue
+            wrong_class += 1
+        false_accepts += 1
+    hours = n_samples / sample_rate / 3600
+    per_label = {}
+    for event, h in zip(events, hit):
+        counts = per_label.setdefault(event["label"], [0, 0])
+        counts[0] += 1
+        counts[1] += not h
+    result = {
+        "detections": len(detections),
+        "false_accepts": false_accepts,
+        "wrong_class": wrong_class,
+        "false_accepts_per_hour": false_accepts / hours,
+        "keywords": len(events),
+        "misses": hit.count(False),
+        "miss_rate": hit.count(False) / max(len(events), 1),
+        "miss_rate_per_label": {label: m / c for label, (c, m) in sorted(per_label.items())},
+    }
+    if delays:
+        result.update({
+            "delay_p50_s": float(np.percentile(delays, 50)),
+            "delay_p95_s": float(np.percentile(delays, 95)),
+            "delay_mean_s": float(np.mean(delays)),
+        })
+    return result
+
+
+def evaluate(
+        model_path: str,
+        stream_path: str,
+        events: Sequence[Dict[str, object]],
+        thresholds: Sequence[float],
+        sample_rate: int = 16000,
+        jobs: Optional[int] = None,
+        segment_s: float = 600.,
+        window_ms: float = 1000,
+        hop_ms: float = 50,
+        energy_threshold: Optional[float] = None,
+        refractory_s: float = 2.,
+        tolerance_s: float = 1.,
+        smoothing: int = 3,
+        backend: Optional[str] = None,
+    ) -> List[Dict[str, object]]:
+    """score the detector on the stream at stream_path for every threshold, segments and thresholds spread over jobs processes"""
+    n = len(np.load(stream_path, mmap_mode="r"))
+    segment = int(segment_s * sample_rate)
+    tasks = [(t, start, min(n, start + segment)) for t in thresholds for start in range(0, n, segment)]
+    options = {"sample_rate": sample_rate, "window_ms": window_ms, "hop_ms": hop_ms,
+        "energy_threshold": energy_threshold, "refractory_s": refractory_s, "smoothing": smoothing}
+    labels = KeywordRuntime.load(model_path).labels
+
+    detections = {t: [] for t in thresholds}
+    started = time.perf_counter()
+    # spawn, not fork: torch's thread pools don't survive a fork
+    ctx = mp.get_context("spawn")
+    with ctx.Pool(jobs or os.cpu_count(), _init_worker, (stream_path, model_path, backend, options)) as pool:
+        for threshold, found in pool.imap_unordered(_detect_segment, tasks):
+            detections[threshold] += found
+    elapsed = time.perf_counter() - started
+    print(f"Evaluated {len(thresholds)} x {n / sample_rate / 3600:.2f} h of audio in {elapsed:.0f} s "
+        f"({len(thresholds) * n / sample_rate / elapsed:.0f}x realtime)")
+
+    results = []
+    for threshold in thresholds:
+        result = {"threshold": threshold, **score(detections[threshold], events, labels, n, sample_rate, tolerance_s)}
+        print(f"threshold {threshold}: {result['false_accepts_per_hour']:.2f} false accepts/h, "
+            f"miss rate {result['miss_rate']:.3f}, delay p50 {result.get('delay_p50_s', float('nan')):.2f} s")
+        results.append(result)
+    return results
+
+
+def _testing_clips(root: str) -> List[str]:
+    with open(os.path.join(root, "testing_list.txt")) as f:
+        return [os.path.join(root, line.strip()) for line in f if line.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="False accept / false reject evaluation of the wake word detector")
+    parser.add_argument("model", help="keyword model artifact (with .json sidecar)")
+    parser.add_argument("--background", nargs="*", default=None, help=f"background WAVs, default: {DEFAULT_BACKGROUND}")
+    parser.add_argument("--keywords", nargs="*", default=None,
+        help="keyword clips to mix in (labelled by their directory), default: data/hal_keywords testing list")
+    parser.add_argument("--hours", type=float, default=1.)
+    parser.add_argument("--every", type=float, default=30., help="mean seconds between keyword clips")
+    parser.add_argument("--keyword-gain-db", type=float, default=0.)
+    parser.add_argument("--thresholds", nargs="+", type=float, default=[.5, .6, .7, .8, .9, .95, .99])
+    parser.add_argument("--energy-threshold", type=float, default=None,
+        help="energy gate threshold (audioop.rms units), default: no gate")
+    parser.add_argument("--hop-ms", type=float, default=50)
+    parser.add_argument("--smoothing", type=int, default=3, help="checks the posteriors are averaged over")
+    parser.add_argument("--refractory", type=float, default=2., help="seconds the detector is off after a detection")
+    parser.add_argument("--tolerance", type=float, default=1., help="seconds after a clip a detection still counts")
+    parser.add_argument("--segment", type=float, default=600., help="seconds of audio per task")
+    parser.add_argument("--jobs", type=int, default=None, help="worker processes, default: all cpus")
+    parser.add_argument("--backend", default=None, help="quantized engine, default depends on the cpu")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=None, help="JSON report path")
+    args = parser.parse_args()
+
+    background = args.background if args.background is not None else sorted(glob.glob(DEFAULT_BACKGROUND))
+    clips = args.keywords if args.keywords is not None else _testing_clips("data/hal_keywords")
+    with tempfile.TemporaryDirectory(prefix="kw-eval-") as tmp:
+        stream_path = os.path.join(tmp, "stream.npy")
+        events = build_stream(stream_path, background, clips, args.hours, args.every,
+            keyword_gain_db=args.keyword_gain_db, seed=args.seed)
+        print(f"{args.hours} h stream with {len(events)} keyword clips from {len(clips)} files, "
+            f"{len(background)} background files")
+        results = evaluate(args.model, stream_path, events, args.thresholds, jobs=args.jobs, segment_s=args.segment,
+            hop_ms=args.hop_ms, energy_threshold=args.energy_threshold, refractory_s=args.refractory,
+            tolerance_s=args.tolerance, smoothing=args.smoothing, backend=args.backend)
+
+    if args.output is not None:
+        report = {
+            "model": args.model,
+            "hours": args.hours,
+            "background": background,
+            "keyword_clips": len(events),
+            "every_s": args.every,
+            "energy_threshold": args.energy_threshold,
+            "hop_ms": args.hop_ms,
+            "smoothing": args.smoothing,
+            "refractory_s": args.refractory,
+            "tolerance_s": args.tolerance,
+            "seed": args.seed,
+            "results": results,
+        }
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Wrote evaluation to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
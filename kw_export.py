@@ -0,0 +1,265 @@
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+import argparse
+import copy
+import inspect
+import json
+import os
+
+import torch
+import torch.nn as nn
+try:
+    from torch.ao import quantization # torch >= 1.10
+except ImportError:
+    from torch import quantization
+
+from kw_runtime import KeywordRuntime, configure_torch, metadata_path, write_metadata
+
+__all__ = ["QuantWrapper", "fusable_layers", "quantize_static", "prepare_qat", "convert_qat",
+    "evaluate", "export_artifact", "write_report", "save_mobile", "save_onnx", "check_parity", "export_formats"]
+
+"""
+fp32 -> int8 export of the keyword model (used by keywords.main):
+
+* quantize_static: post training static quantization, observers calibrated
+  on held-out batches (HAL_KW.calibration_dataloader, the "testing" split)
+* prepare_qat/convert_qat: quantization aware training, the prepared model
+  is trained like the fp32 one (KeywordModel(model=prepare_qat(...)))
+
+Both fuse conv-bn-relu first and wrap the net in QuantWrapper, so the int8
+artifacts take and return float tensors just like the fp32 one.
+export_artifact saves a TorchScript artifact with its sidecar and measures it;
+write_report collects the measurements into one JSON file.
+
+export_formats converts an exported artifact into the other formats
+kw_runtime can load (mobile optimized TorchScript, ONNX) and checks each
+conversion against the original on the validation set, without touching
+the training code:
+
+    python kw_export.py models/audio_model_fp32.pt --formats mobile onnx
+"""
+
+Batches = Iterable[Tuple[torch.Tensor, torch.Tensor]]
+
+
+class QuantWrapper(nn.Module):
+    """float in, float out: quantize the input, run model, dequantize its output"""
+    def __init__(self, model: nn.Module):
+        super().__init__()
+        self.quant = quantization.QuantStub()
+        self.model = model
+        self.dequant = quantization.DeQuantStub()
+
+    def forward(self, x: torch.Tensor) -> torch.Tensor:
+        return self.dequant(self.model(self.quant(x)))
+
+
+def fusable_layers(model: nn.Sequential, prefix: str = "") -> List[List[str]]:
+    """names of all conv-bn-relu triples in a sequential model, for fuse_modules"""
+    layers = []
+    for i in range(len(model) - 2):
+        if (isinstance(model[i], nn.Conv2d) and
+            isinstance(model[i + 1], nn.BatchNorm2d) and
+            isinstance(model[i + 2], nn.ReLU)):
+            layers.append([f"{prefix}{j}" for j in (i, i + 1, i + 2)])
+    return layers
+
+
+def quantize_static(model: nn.Sequential, calibration: Batches, backend: str,
+        max_batches: Optional[int] = None) -> nn.Module:
+    """int8 copy of a trained model, activation ranges observed on the calibration batches"""
+    qmodel = QuantWrapper(copy.deepcopy(model)).cpu().eval()
+    quantization.fuse_modules(qmodel, fusable_layers(qmodel.model, "model."), inplace=True)
+    qmodel.qconfig = quantization.get_default_qconfig(backend)
+    quantization.prepare(qmodel, inplace=True)
+    with torch.no_grad():
+        for i, (inp, _) in enumerate(calibration):
+            if max_batches is not None and i >= max_batches:
+                break
+            qmodel(inp.cpu())
+    return quantization.convert(qmodel, inplace=True)
+
+
+def prepare_qat(model: nn.Sequential, backend: str) -> nn.Module:
+    """fused copy of model with fake quantization, ready for training"""
+    qmodel = QuantWrapper(copy.deepcopy(model)).train()
+    # torch >= 1.11 has a separate entry point for fusing in train mode
+    fuse = getattr(quantization, "fuse_modules_qat", quantization.fuse_modules)
+    fuse(qmodel, fusable_layers(qmodel.model, "model."), inplace=True)
+    qmodel.qconfig = quantization.get_default_qat_qconfig(backend)
+    return quantization.prepare_qat(qmodel, inplace=True)
+
+
+def convert_qat(qmodel: nn.Module) -> nn.Module:
+    """int8 model from a quantization aware trained one (which is left untouched)"""
+    return quantization.convert(copy.deepcopy(qmodel).cpu().eval(), inplace=True)
+
+
+def evaluate(model, batches: Batches) -> float:
+    """top 1 accuracy of model (any callable returning class scores) on the batches"""
+    correct = total = 0
+    with torch.no_grad():
+        for inp, label in batches:
+            pred = model(inp.cpu()).argmax(dim=-1)
+            correct += (pred == label.cpu()).sum().item()
+            total += len(label)
+    return correct / max(total, 1)
+
+
+def export_artifact(module: nn.Module, path: str, labels: List[str], sample_rate: int,
+        batches: Optional[Batches] = None, runs: int = 200, **extra) -> Dict[str, object]:
+    """
+    Script and save module with its sidecar, then load it back like the assistant does
+    and measure it: accuracy on batches (stored in the sidecar too),
+    size on disk and median latency of one window.
+    """
+    torch.jit.save(torch.jit.script(module.cpu().eval()), path)
+    write_metadata(path, labels, sample_rate, **extra)
+    return _measure(path, batches, runs)
+
+
+def _measure(path: str, batches: Optional[Batches] = None, runs: int = 200) -> Dict[str, object]:
+    runtime = KeywordRuntime.load(path)
+    accuracy = evaluate(runtime, batches) if batches is not None else None
+    if accuracy is not None:
+        # select_runtime compares this against its accuracy floor
+        meta = dict(runtime.meta, accuracy=accuracy)
+        with open(metadata_path(path), "w") as f:
+            json.dump(meta, f, indent=2)
+    entry = {
+        "path": path,
+        "accuracy": accuracy,
+        "size_bytes": os.path.getsize(path),
+        "latency_ms": runtime.benchmark(runs=runs) * 1000,
+    }
+    print(f"{path}: accuracy {accuracy}, {entry['size_bytes'] / 1024:.0f} KiB, {entry['latency_ms']:.2f} ms")
+    return entry
+
+
+def write_report(path: str, artifacts: Dict[str, Dict[str, object]], backend: str, **info) -> str:
+    """machine readable summary of an export run, one entry per artifact"""
+    report = {
+        "backend": backend,
+        "torch": torch.__version__,
+        "num_threads": torch.get_num_threads(),
+        **info,
+        "artifacts": artifacts,
+    }
+    with open(path, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Wrote export report to {path}")
+    return path
+
+
+def save_mobile(module, path: str) -> None:
+    """frozen TorchScript with the mobile passes (conv/linear prepacked for XNNPACK, ops fused)"""
+    import torch.backends.xnnpack
+    from torch.utils.mobile_optimizer import optimize_for_mobile
+
+    if not isinstance(module, torch.jit.ScriptModule):
+        module = torch.jit.script(module.cpu().eval())
+    module = module.eval()
+    if torch.backends.xnnpack.enabled:
+        # freezes the module (weights become constants) before optimizing
+        module = optimize_for_mobile(module)
+    else:
+        # e.g. x86 builds without XNNPACK
+        print("XNNPACK not available in this torch build, saving plain frozen TorchScript")
+        module = torch.jit.freeze(module)
+    torch.jit.save(module, path)
+
+
+def save_onnx(module, path: str, window: int, opset: int = 17) -> None:
+    """ONNX graph of a (batch, 2, time) -> (batch, classes) model, batch size and length left dynamic"""
+    kwargs = {}
+    if "dynamo" in inspect.signature(torch.onnx.export).parameters:
+        # the TorchScript based exporter also handles scripted modules
+        kwargs["dynamo"] = False
+    torch.onnx.export(
+        module, (torch.zeros(1, 2, window),), path,
+        input_names=["audio"], output_names=["scores"],
+        dynamic_axes={"audio": {0: "batch", 2: "time"}, "scores": {0: "batch"}},
+        opset_version=opset, **kwargs)
+
+
+def check_parity(reference, candidate, batches: Batches, atol: float = 1e-3) -> Dict[str, object]:
+    """compare two runtimes clip by clip: largest score difference and top 1 agreement"""
+    max_diff, agree, total = 0., 0, 0
+    with torch.no_grad():
+        for inp, _ in batches:
+            a, b = reference(inp.cpu()), candidate(inp.cpu())
+            max_diff = max(max_diff, (a - b).abs().max().item())
+            agree += (a.argmax(dim=-1) == b.argmax(dim=-1)).sum().item()
+            total += len(inp)
+    agreement = agree / max(total, 1)
+    return {
+        "clips": total,
+        "max_abs_diff": max_diff,
+        "agreement": agreement,
+        "passed": max_diff <= atol and agreement == 1.,
+    }
+
+
+def export_formats(path: str, formats: Sequence[str] = ("mobile", "onnx"), batches: Optional[Batches] = None,
+        atol: float = 1e-3, runs: int = 200) -> Dict[str, Dict[str, object]]:
+    """
+    Convert the artifact at path (plus sidecar) into formats, next to it
+    (audio_model_fp32.pt -> audio_model_fp32_mobile.pt, audio_model_fp32_onnx.onnx,
+    each with its own sidecar),
+    measure every artifact and check conversions against the original on batches.
+    """
+    batches = list(batches) if batches is not None else None
+    source = KeywordRuntime.load(path)
+    stem = os.path.splitext(path)[0]
+    artifacts = {source.format: _measure(path, batches, runs)}
+    for format in formats:
+        if format == "mobile":
+            out = stem + "_mobile.pt"
+            save = lambda: save_mobile(source.module, out)
+        elif format == "onnx":
+            out = stem + "_onnx.onnx"
+            save = lambda: save_onnx(source.module, out, source.window)
+        else:
+            raise ValueError(f"can't export to {format}, choose from mobile, onnx")
+        try:
+            save()
+            extra = {k: v for k, v in source.meta.items() if k not in ("labels", "sample_rate", "window", "accuracy")}
+            extra["format"] = format
+            write_metadata(out, source.labels, source.sample_rate, source.window, **extra)
+            artifacts[format] = entry = _measure(out, batches, runs)
+        except Exception as e:
+            # e.g. eager mode int8 models have no ONNX export
+            error = str(e).splitlines()[0]
+            print(f"Could not export {path} to {format}: {error}")
+            artifacts[format] = {"path": out, "error": error}
+            continue
+        if batches is not None:
+            entry["parity"] = check_parity(source, KeywordRuntime.load(out), batches, atol)
+            print(f"{format} parity: {entry['parity']}")
+    return artifacts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert exported keyword models to other runtime formats")
+    parser.add_argument("paths", nargs="+", help="exported TorchScript artifacts (with .json sidecars)")
+    parser.add_argument("--formats", nargs="+", default=["mobile", "onnx"], choices=["mobile", "onnx"])
+    parser.add_argument("--data", default="data", help="dataset root for the parity check, '' to skip it")
+    parser.add_argument("--backend", default=None, help="quantized engine, default depends on the cpu")
+    parser.add_argument("--atol", type=float, default=1e-3)
+    parser.add_argument("--report", default="models/format_report.json")
+    args = parser.parse_args()
+
+    backend = configure_torch(args.backend, num_threads=1)
+    batches = None
+    if args.data:
+        from keywords import HAL_KW # training stack, only for the validation set
+
+        batches = list(HAL_KW(dl_path=args.data, device="cpu").val_dataloader())
+    artifacts = {}
+    for path in args.paths:
+        for format, entry in export_formats(path, args.formats, batches, args.atol).items():
+            artifacts[f"{os.path.basename(os.path.splitext(path)[0])}:{format}"] = entry
+    write_report(args.report, artifacts, backend)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,241 @@
+from typing import List, Optional, Sequence
+import json
+import os
+import platform
+import time
+
+import torch
+
+from pcm import PCMFrame
+
+__all__ = ["KeywordRuntime", "OnnxModule", "FORMATS", "load_module", "score_windows", "read_metadata",
+    "write_metadata", "metadata_path", "configure_torch", "select_runtime"]
+
+"""
+Keyword model inference without the training stack (no pytorch_lightning,
+matplotlib or dataset walking): a TorchScript artifact plus a small JSON
+sidecar next to it (models/audio_model_fp32.pt -> models/audio_model_fp32.json)
+holding the labels and the input format the model was trained on.
+keywords.main writes the sidecars when exporting.
+
+The sidecar's "format" says how to load the artifact (see FORMATS):
+plain TorchScript, frozen TorchScript optimized for mobile (XNNPACK)
+or ONNX run by onnxruntime; kw_export converts between them.
+"""
+
+DEFAULT_SAMPLE_RATE = 8000
+# "torchscript" and "mobile" both load with torch.jit.load
+FORMATS = ("torchscript", "mobile", "onnx")
+
+
+def default_backend() -> str:
+    # qnnpack is the quantized engine for ARM (the Pi), fbgemm the one for x86
+    machine = platform.machine().lower()
+    if machine.startswith("arm") or machine.startswith("aarch64"):
+        return "qnnpack"
+    return "fbgemm"
+
+
+def configure_torch(backend: Optional[str] = None, num_threads: Optional[int] = 1, interop_threads: Optional[int] = 1) -> str:
+    """
+    Pick the quantized engine and pin torch's thread pools; call before loading models.
+    Returns the engine actually in use.
+    """
+    backend = backend if backend is not None else default_backend()
+    if backend in torch.backends.quantized.supported_engines:
+        torch.backends.quantized.engine = backend
+    else:
+        print(f"Quantized engine {backend} not supported here, using {torch.backends.quantized.engine}")
+    if num_threads is not None:
+        torch.set_num_threads(num_threads)
+    if interop_threads is not None:
+        try:
+            torch.set_num_interop_threads(interop_threads)
+        except RuntimeError:
+            # can only be set once, before any inter-op parallel work
+            pass
+    return torch.backends.quantized.engine
+
+
+def metadata_path(path: str) -> str:
+    return os.path.splitext(path)[0] + ".json"
+
+
+def write_metadata(path: str, labels: List[str], sample_rate: int, window: Optional[int] = None, **extra) -> str:
+    """Write the sidecar for the artifact at path; returns the sidecar's path."""
+    meta = {
+        "labels": list(labels),
+        "sample_rate": int(sample_rate),
+        # input samples per window (one second by default) and stereo rows, see M5_2d
+        "window": int(window if window is not None else sample_rate),
+        "channels": 2,
+        **extra,
+    }
+    meta_path = metadata_path(path)
+    with open(meta_path, "w") as f:
+        json.dump(meta, f, indent=2)
+    return meta_path
+
+
+def read_metadata(path: str) -> dict:
+    with open(metadata_path(path)) as f:
+        return json.load(f)
+
+
+class OnnxModule:
+    """onnxruntime session behind the same tensor in, tensor out call as a TorchScript module"""
+    def __init__(self, path: str, num_threads: Optional[int] = None):
+        import onnxruntime # only needed for ONNX artifacts
+
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = num_threads if num_threads is not None else torch.get_num_threads()
+        options.inter_op_num_threads = 1
+        self.session = onnxruntime.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+        self.input_name = self.session.get_inputs()[0].name
+
+    def __call__(self, x: torch.Tensor) -> torch.Tensor:
+        x = x.detach().to(torch.float32).contiguous().numpy()
+        return torch.from_numpy(self.session.run(None, {self.input_name: x})[0])
+
+    def eval(self):
+        return self
+
+
+def load_module(path: str, format: Optional[str] = None, map_location: str = "cpu"):
+    """artifact at path as a callable module; format defaults to the file extension's"""
+    if format is None:
+        format = "onnx" if path.endswith(".onnx") else "torchscript"
+    assert format in FORMATS, f"unknown keyword model format {format}, choose from {FORMATS}"
+    if format == "onnx":
+        return OnnxModule(path)
+    module = torch.jit.load(path, map_location=map_location)
+    module.eval()
+    return module
+
+
+def score_windows(model, signal: torch.Tensor, window: int, step: int, reduce: str = "max") -> torch.Tensor:
+    """
+    Class posteriors for all windows of a mono signal starting step samples apart,
+    scored in one batched forward pass and aggregated over the offsets ("max" or "mean").
+    """
+    # (offsets, window) views into signal, duplicated into both input channels
+    windows = signal.unfold(0, window, step)
+    x = windows.unsqueeze(1).expand(-1, 2, -1)
+    with torch.no_grad():
+        posteriors = model(x).softmax(dim=-1)
+    if reduce == "max":
+        return posteriors.max(dim=0).values
+    return posteriors.mean(dim=0)
+
+
+class KeywordRuntime:
+    """
+    Drop-in for KeywordModel at inference time
+    (sample_rate, __call__, infer, score_windows), loaded from an exported artifact.
+    """
+    def __init__(self, module: torch.nn.Module, labels: List[str], sample_rate: int = DEFAULT_SAMPLE_RATE,
+            window: Optional[int] = None, path: Optional[str] = None, meta: Optional[dict] = None):
+        self.module = module
+        self.labels = list(labels)
+        self.sample_rate = int(sample_rate)
+        self.window = int(window if window is not None else sample_rate)
+        self.path = path
+        self.meta = meta if meta is not None else {}
+
+    @classmethod
+    def load(cls, path: str, map_location: str = "cpu") -> "KeywordRuntime":
+        try:
+            meta = read_metadata(path)
+        except FileNotFoundError:
+            print(f"No metadata found at {metadata_path(path)}, assuming {DEFAULT_SAMPLE_RATE} Hz and unnamed labels")
+            meta = {}
+        module = load_module(path, meta.get("format"), map_location)
+        runtime = cls(module, meta.get("labels", []), meta.get("sample_rate", DEFAULT_SAMPLE_RATE), meta.get("window"), path, meta)
+
+        # check the artifact against its labels on a silent window
+        n_classes = runtime(torch.zeros(1, 2, runtime.window)).shape[-1]
+        if "labels" not in meta:
+            # one label per output unit
+            runtime.labels = [str(i) for i in range(n_classes)]
+        elif n_classes != len(runtime.labels):
+            raise ValueError(f"{path} has {n_classes} outputs, but its metadata lists {len(runtime.labels)} labels")
+        return runtime
+
+    @property
+    def accuracy(self) -> Optional[float]:
+        """validation accuracy recorded at export time, if any"""
+        return self.meta.get("accuracy")
+
+    def __call__(self, x: torch.Tensor) -> torch.Tensor:
+        with torch.no_grad():
+            if self.meta.get("quantize_input", False):
+                # int8 artifacts exported without quant/dequant around forward
+                return self.module(self.module.quant(x))
+            return self.module(x)
+
+    def benchmark(self, runs: int = 50, warmup: int = 10) -> float:
+        """median latency of one window in seconds"""
+        x = torch.zeros(1, 2, self.window)
+        for _ in range(warmup):
+            self(x)
+        times = []
+        for _ in range(runs):
+            start = time.perf_counter()
+            self(x)
+            times.append(time.perf_counter() - start)
+        return sorted(times)[len(times) // 2]
+
+    def infer(self, frame: PCMFrame) -> torch.Tensor:
+        """Class scores for a single PCM frame at self.sample_rate."""
+        assert frame.sample_rate == self.sample_rate, \
+            f"model expects {self.sample_rate} Hz audio, got {frame.sample_rate} Hz"
+        return self(frame.to_tensor().expand(2, -1).unsqueeze(0))
+
+    def score_windows(self, signal: torch.Tensor, window: int, step: int, reduce: str = "max") -> torch.Tensor:
+        return score_windows(self, signal, window, step, reduce)
+
+    def index_to_label(self, index: int) -> str:
+        return self.labels[index]
+
+    @property
+    def format(self) -> str:
+        return self.meta.get("format", "onnx" if isinstance(self.module, OnnxModule) else "torchscript")
+
+    def __repr__(self):
+        return f"KeywordRuntime({self.path}, {self.format}, {len(self.labels)} labels, {self.sample_rate} Hz)"
+
+
+def select_runtime(
+        paths: Sequence[Optional[str]],
+        accuracy_floor: Optional[float] = None,
+        backend: Optional[str] = None,
+        num_threads: Optional[int] = 1,
+        interop_threads: Optional[int] = 1,
+        runs: int = 50,
+    ) -> Optional[KeywordRuntime]:
+    """
+    Startup self-benchmark: load every available artifact (e.g. fp32, int8, mobile, ONNX),
+    drop those that fail to load, disagree with their labels or fall below
+    accuracy_floor (validation accuracy from their metadata; without a floor
+    accuracy is not checked) and return the fastest of the rest.
+    """
+    engine = configure_torch(backend, num_threads, interop_threads)
+    best, best_time = None, float("inf")
+    for path in paths:
+        if path is None or not os.path.exists(path):
+            continue
+        try:
+            runtime = KeywordRuntime.load(path)
+            latency = runtime.benchmark(runs=runs)
+        except Exception as e:
+            print(f"Skipping keyword model {path}: {e}")
+            continue
+        if accuracy_floor is not None and (runtime.accuracy is None or runtime.accuracy < accuracy_floor):
+            print(f"Skipping keyword model {path}: accuracy {runtime.accuracy} below {accuracy_floor}")
+            continue
+        print(f"Keyword model {path}: {latency * 1000:.1f} ms per window ({runtime.format}, {engine})")
+        if latency < best_time:
+            best, best_time = runtime, latency
+    if best is not None:
+        print(f"Using keyword model {best.path}")
+    return best
@@ -0,0 +1,210 @@
+from typing import Optional, Tuple
+import multiprocessing as mp
+from multiprocessing import shared_memory
+
+import numpy as np
+import torch
+
+from cascade import KeywordDecision
+from kw_runtime import DEFAULT_SAMPLE_RATE, KeywordRuntime, configure_torch, read_metadata
+from ring_buffer import AudioRingBuffer
+
+__all__ = ["SharedAudioRing", "KeywordWorker"]
+
+"""
+Out of process wake word engine.
+
+The recognizer keeps capturing and resampling in the main process, but
+writes into a SharedAudioRing instead of a private one. A KeywordWorker
+process attaches to the same shared memory, runs the keyword model on
+the newest window every hop and posts detections back over a pipe, so
+inference never competes with hal's other threads for the GIL.
+"""
+
+HEADER = 2 # int64 slots in front of the samples: pos, written
+
+
+class SharedAudioRing(AudioRingBuffer):
+    """AudioRingBuffer whose samples and write position live in multiprocessing.shared_memory."""
+    def __init__(self, capacity: int, sample_rate: int, name: Optional[str] = None):
+        create = name is None
+        nbytes = HEADER * 8 + 2 * int(capacity) * 4
+        # NOTE attaching processes must be spawned from the creator, so they share its
+        # resource tracker; the creator unlinks the block (see close)
+        self.shm = shared_memory.SharedMemory(name=name, create=create, size=nbytes)
+        self._header = np.ndarray((HEADER,), dtype=np.int64, buffer=self.shm.buf)
+        storage = np.ndarray((2 * int(capacity),), dtype=np.float32, buffer=self.shm.buf, offset=HEADER * 8)
+
+        header = self._header.copy()
+        super().__init__(capacity, sample_rate, storage=storage)
+        if not create:
+            # super().__init__ zeroed the shared positions, restore them
+            self._header[:] = header
+
+    @property
+    def name(self) -> str:
+        return self.shm.name
+
+    @property
+    def _pos(self) -> int:
+        return int(self._header[0])
+
+    @_pos.setter
+    def _pos(self, value: int):
+        self._header[0] = value
+
+    @property
+    def written(self) -> int:
+        return int(self._header[1])
+
+    @written.setter
+    def written(self, value: int):
+        self._header[1] = value
+
+    def close(self, unlink: bool = False) -> None:
+        # views into the block have to go before it can be closed
+        del self._tensor, self._data, self._header
+        self.shm.close()
+        if unlink:
+            self.shm.unlink()
+
+
+def load_keyword_model(model_path: str):
+    return KeywordRuntime.load(model_path)
+
+
+def _worker_main(ring_name, capacity, sample_rate, window, hop, model_path, backend, num_threads, decision, conn, stop):
+    configure_torch(backend, num_threads)
+    ring = SharedAudioRing(capacity, sample_rate, name=ring_name)
+    model = load_keyword_model(model_path)
+    decision.reset(model.labels)
+
+    inp = torch.empty(1, 1, window)
+    model_inp = inp.expand(1, 2, window)
+    poll_interval = hop / sample_rate / 2
+
+    conn.send(("ready", None))
+    next_check = ring.written + window
+    try:
+        while not stop.is_set():
+            written = ring.written
+            if written < next_check:
+                stop.wait(poll_interval)
+                continue
+            # always look at the newest window, the recognizer keeps the audio
+            end = written
+            inp[0, 0].copy_(ring.latest(window, offset=ring.written - end))
+            if ring.written - end > ring.capacity - window:
+                # producer lapped us while copying, window is torn
+                conn.send(("overrun", end))
+                next_check = ring.written
+                continue
+            with torch.no_grad():
+                posteriors = model(model_inp).softmax(dim=-1)[0]
+            detection = decision.update(posteriors)
+            if detection is not None:
+                keyword_result, score = detection
+                conn.send(("detection", (end, keyword_result, decision.labels[keyword_result], score)))
+                # start smoothing afresh, like a new wait_for_keyword would
+                decision.reset()
+            next_check = end + hop
+    finally:
+        ring.close()
+        conn.close()
+
+
+class KeywordWorker:
+    """
+    Handle for the wake word worker process, usable as keyword_model of
+    CustomRecognizer.wait_for_keyword. Start/stop it with a with-statement
+    (VoiceControlledAutomaton.run does this for kw_process=True).
+    """
+    def __init__(
+            self,
+            model_path: str,
+            sample_rate: Optional[int] = None,
+            window_ms: float = 1000,
+            hop_ms: float = 50,
+            max_lag_ms: float = 2000,
+            backend: Optional[str] = None,
+            num_threads: int = 1,
+            decision: Optional[KeywordDecision] = None,
+        ):
+        self.model_path = model_path
+        if sample_rate is None:
+            try:
+                sample_rate = read_metadata(model_path)["sample_rate"]
+            except FileNotFoundError:
+                sample_rate = DEFAULT_SAMPLE_RATE
+        self.sample_rate = sample_rate
+        self.window = int(round(sample_rate * window_ms / 1000))
+        self.hop = max(1, int(round(sample_rate * hop_ms / 1000)))
+        self.capacity = self.window + int(round(sample_rate * max_lag_ms / 1000))
+        self.backend = backend
+        self.num_threads = num_threads
+        # smoothing and thresholds, applied in the worker (see CustomRecognizer.keyword_decision)
+        self.decision = decision if decision is not None else KeywordDecision()
+
+        self.ring: Optional[SharedAudioRing] = None
+        self._process = None
+        self._conn = None
+        self._stop = None
+
+    @property
+    def running(self) -> bool:
+        return self._process is not None and self._process.is_alive()
+
+    def start(self, timeout: float = 60.) -> "KeywordWorker":
+        if self.running:
+            return self
+        # spawn, not fork: the parent runs capture threads
+        ctx = mp.get_context("spawn")
+        self.ring = SharedAudioRing(self.capacity, self.sample_rate)
+        recv, send = ctx.Pipe(duplex=False)
+        self._stop = ctx.Event()
+        self._process = ctx.Process(
+            target=_worker_main,
+            args=(self.ring.name, self.capacity, self.sample_rate, self.window, self.hop,
+                self.model_path, self.backend, self.num_threads, self.decision, send, self._stop),
+            name="keyword-worker",
+            daemon=True,
+        )
+        self._process.start()
+        send.close()
+        self._conn = recv
+        if not recv.poll(timeout) or recv.recv()[0] != "ready":
+            self.stop()
+            raise RuntimeError(f"keyword worker did not come up within {timeout} s")
+        return self
+
+    def stop(self, timeout: float = 5.) -> None:
+        if self._process is not None:
+            self._stop.set()
+            self._process.join(timeout)
+            if self._process.is_alive():
+                self._process.terminate()
+                self._process.join()
+            self._process = None
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+        if self.ring is not None:
+            self.ring.close(unlink=True)
+            self.ring = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def poll(self, timeout: float = 0.) -> Optional[Tuple[str, object]]:
+        """Next (event, payload) from the worker, or None if there is none within timeout."""
+        if self._conn.poll(timeout):
+            try:
+                return self._conn.recv()
+            except EOFError:
+                pass
+        if not self._process.is_alive():
+            raise RuntimeError(f"keyword worker died with exit code {self._process.exitcode}")
+        return None
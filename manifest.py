@@ -0,0 +1,205 @@
+from typing import Dict, List, Optional, Sequence, Tuple
+import collections
+import os
+import struct
+
+import numpy as np
+
+__all__ = ["DatasetManifest", "wav_info", "SPLITS", "MANIFEST_NAME"]
+
+"""
+Column store of the keyword dataset (data/hal_keywords/manifest.npz):
+one row per clip with its path relative to the dataset root, label index,
+sample count, sample rate, split and mtime. Built by scanning the label
+directories once; refresh() afterwards only stats the label directories and
+the split lists, and rereads the headers of clips in directories that changed.
+HAL_KW_DATASET and HAL_KW read labels, splits and lengths from here instead
+of globbing and decoding files.
+"""
+
+SPLITS = ("training", "validation", "testing")
+MANIFEST_NAME = "manifest.npz"
+# a clip listed in both lists counts as validation (later lists win)
+SPLIT_LISTS = {"testing": "testing_list.txt", "validation": "validation_list.txt"}
+# directories next to the labels that hold no keyword clips
+EXCLUDE_DIRS = ("_background_noise_",)
+COLUMNS = ("path", "label", "num_samples", "sample_rate", "split", "mtime")
+
+
+def wav_info(path: str) -> Tuple[int, int]:
+    """(frames, sample rate) of a WAV file, read from its header only"""
+    with open(path, "rb") as f:
+        riff = f.read(12)
+        assert riff[:4] == b"RIFF" and riff[8:12] == b"WAVE", f"{path} is not a WAV file"
+        sample_rate = block_align = None
+        while True:
+            header = f.read(8)
+            if len(header) < 8:
+                raise ValueError(f"{path} has no data chunk")
+            chunk_id, size = header[:4], struct.unpack("<I", header[4:])[0]
+            if chunk_id == b"fmt ":
+                _, _, sample_rate, _, block_align = struct.unpack("<HHIIH", f.read(size)[:14])
+                f.seek(size & 1, 1)
+            elif chunk_id == b"data":
+                assert block_align, f"{path}: data chunk before fmt chunk"
+                return size // block_align, sample_rate
+            else:
+                f.seek(size + (size & 1), 1)
+
+
+class DatasetManifest:
+    """
+    Columns (numpy arrays, one entry per clip, sorted by path):
+    path, label (index into labels), num_samples, sample_rate, split (index into SPLITS), mtime.
+    """
+    def __init__(
+            self,
+            root: str,
+            columns: Optional[Dict[str, np.ndarray]] = None,
+            labels: Sequence[str] = (),
+            dir_mtimes: Optional[Dict[str, float]] = None,
+            list_mtimes: Sequence[float] = (0., 0.),
+        ):
+        self.root = root
+        self._set(columns, labels, dir_mtimes, list_mtimes)
+
+    def _set(self, columns, labels, dir_mtimes, list_mtimes) -> None:
+        if columns is None:
+            columns = {
+                "path": np.array([], dtype=str),
+                "label": np.array([], dtype=np.int32),
+                "num_samples": np.array([], dtype=np.int64),
+                "sample_rate": np.array([], dtype=np.int32),
+                "split": np.array([], dtype=np.int8),
+                "mtime": np.array([], dtype=np.float64),
+            }
+        self.path = columns["path"]
+        self.label = columns["label"]
+        self.num_samples = columns["num_samples"]
+        self.sample_rate = columns["sample_rate"]
+        self.split = columns["split"]
+        self.mtime = columns["mtime"]
+        self.labels = [str(l) for l in labels]
+        self.label_to_index = {l: i for i, l in enumerate(self.labels)}
+        self.dir_mtimes = dict(dir_mtimes or {})
+        self.list_mtimes = tuple(float(m) for m in list_mtimes)
+
+    @property
+    def manifest_path(self) -> str:
+        return os.path.join(self.root, MANIFEST_NAME)
+
+    def __len__(self) -> int:
+        return len(self.path)
+
+    @classmethod
+    def load(cls, root: str, refresh: bool = True) -> "DatasetManifest":
+        """the manifest of the dataset at root, built if there is none; refresh picks up changed clips"""
+        path = os.path.join(root, MANIFEST_NAME)
+        if os.path.exists(path):
+            with np.load(path, allow_pickle=False) as data:
+                manifest = cls(
+                    root,
+                    {c: data[c] for c in COLUMNS},
+                    data["labels"],
+                    dict(zip(data["dirs"].tolist(), data["dir_mtimes"].tolist())),
+                    data["list_mtimes"],
+                )
+        else:
+            manifest = cls(root)
+            refresh = True
+        if refresh and manifest.refresh():
+            manifest.save()
+        return manifest
+
+    def save(self) -> str:
+        path = self.manifest_path
+        tmp = path + ".tmp.npz"
+        np.savez(
+            tmp,
+            labels=np.array(self.labels, dtype=str),
+            dirs=np.array(list(self.dir_mtimes), dtype=str),
+            dir_mtimes=np.array(list(self.dir_mtimes.values()), dtype=np.float64),
+            list_mtimes=np.array(self.list_mtimes, dtype=np.float64),
+            **{c: getattr(self, c) for c in COLUMNS},
+        )
+        # readers never see a half written manifest
+        os.replace(tmp, path)
+        return path
+
+    def _split_lists(self) -> Dict[str, int]:
+        splits = {}
+        for split, filename in SPLIT_LISTS.items():
+            list_path = os.path.join(self.root, filename)
+            if not os.path.exists(list_path):
+                continue
+            with open(list_path) as f:
+                for line in f:
+                    if line.strip():
+                        splits[os.path.normpath(line.strip()).replace(os.sep, "/")] = SPLITS.index(split)
+        return splits
+
+    def refresh(self, full: bool = False) -> bool:
+        """
+        Bring the manifest up to date with the files under root; returns whether anything changed.
+        Only label directories whose mtime changed (clips added, removed or replaced) are
+        listed again, and only new or modified clips in them have their headers read;
+        full also lists unchanged directories, for clips overwritten in place.
+        """
+        list_mtimes = tuple(
+            os.stat(os.path.join(self.root, f)).st_mtime if os.path.exists(os.path.join(self.root, f)) else 0.
+            for f in SPLIT_LISTS.values())
+        dir_mtimes = {
+            entry.name: entry.stat().st_mtime
+            for entry in os.scandir(self.root)
+            if entry.is_dir() and entry.name not in EXCLUDE_DIRS and not entry.name.startswith((".", "__"))
+        }
+        if not full and dir_mtimes == self.dir_mtimes and list_mtimes == self.list_mtimes:
+            return False
+        old_columns = {c: getattr(self, c) for c in COLUMNS}
+        old_state = (self.labels, self.dir_mtimes, self.list_mtimes)
+
+        old = {p: i for i, p in enumerate(self.path.tolist())}
+        by_dir = collections.defaultdict(list)
+        for p, i in old.items():
+            by_dir[p.split("/", 1)[0]].append(i)
+        rows: List[Tuple[str, str, int, int, float]] = []
+        for name, mtime in sorted(dir_mtimes.items()):
+            if not full and self.dir_mtimes.get(name) == mtime:
+                # unchanged directory, keep its rows as they are
+                rows += [(str(self.path[i]), name, int(self.num_samples[i]), int(self.sample_rate[i]), float(self.mtime[i]))
+                    for i in by_dir[name]]
+                continue
+            for entry in os.scandir(os.path.join(self.root, name)):
+                if not entry.name.endswith(".wav"):
+                    continue
+                path = f"{name}/{entry.name}"
+                file_mtime = entry.stat().st_mtime
+                i = old.get(path)
+                if i is not None and self.mtime[i] == file_mtime:
+                    rows.append((path, name, int(self.num_samples[i]), int(self.sample_rate[i]), file_mtime))
+                else:
+                    num_samples, sample_rate = wav_info(entry.path)
+                    rows.append((path, name, num_samples, sample_rate, file_mtime))
+        rows.sort()
+
+        labels = sorted({name for _, name, *_ in rows})
+        label_to_index = {l: i for i, l in enumerate(labels)}
+        splits = self._split_lists()
+        paths = [r[0] for r in rows]
+        columns = {
+            "path": np.array(paths, dtype=str),
+            "label": np.array([label_to_index[r[1]] for r in rows], dtype=np.int32),
+            "num_samples": np.array([r[2] for r in rows], dtype=np.int64),
+            "sample_rate": np.array([r[3] for r in rows], dtype=np.int32),
+            "split": np.array([splits.get(p, 0) for p in paths], dtype=np.int8),
+            "mtime": np.array([r[4] for r in rows], dtype=np.float64),
+        }
+        self._set(columns, labels, dir_mtimes, list_mtimes)
+        return (labels, dir_mtimes, list_mtimes) != old_state or \
+            any(not np.array_equal(columns[c], old_columns[c]) for c in COLUMNS)
+
+    def indices(self, subset: Optional[str] = None) -> np.ndarray:
+        """rows of a split ("training", "validation", "testing"), all rows for None"""
+        if subset is None:
+            return np.arange(len(self))
+        return np.flatnonzero(self.split == SPLITS.index(subset))
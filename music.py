@@ -8,7 +8,7 @@ from time import sleep
 import numpy as np
 import math
 
-from automaton import VoiceControlledAutomaton, State, Exit, DEBUG
+from automaton import VoiceControlledAutomaton, State, Exit, DEBUG, LazyAutomaton
 
 # this module contains two voicecontrolledautomata:
 # 1: jukebox; for playing music on disk
@@ -53,10 +53,13 @@ class JukeBox(VoiceControlledAutomaton):
         }
 
         # kwargs["_super"] = self # already done in automaton.py
-        self.LocalPlayer = LocalPlayer(
+        # built on first use: LocalPlayer lists the music dir and asks amixer for the volume
+        self.LocalPlayer = LazyAutomaton(
+            LocalPlayer,
             **kwargs,
         )
-        self.YoutubePlayer = YoutubePlayer(
+        self.YoutubePlayer = LazyAutomaton(
+            YoutubePlayer,
             **kwargs
         )
 
@@ -103,8 +106,12 @@ class MusicPlayer:
         raise NotImplementedError
     def pause(self):
         self._playing = False
+        # listen with the quiet room energy threshold again
+        self.noise_floor.set_profile("quiet")
     def play(self):
         self._playing = True
+        # music raises the noise floor; track it separately
+        self.noise_floor.set_profile("music")
 
     def adjust_volume(self, percent:int =5):
         curr_vol = self.get_sys_volume()
@@ -233,6 +240,7 @@ class LocalPlayer(VoiceControlledAutomaton, MusicPlayer):
                 if DEBUG: print(self.name+" couldnt handle your request, exiting higher level FSA")
                 if self.process is not None:
                     self.process.send_signal(signal.SIGTERM)
+                    self.pause() # MusicPlayer state change
                 raise Exit(text)
 
         return state
@@ -519,6 +527,7 @@ class YoutubePlayer(VoiceControlledAutomaton, MusicPlayer):
                 if DEBUG: print(self.name+" couldnt handle your request, exiting higher level FSA")
                 if self.process is not None:
                     self.process.send_signal(signal.SIGTERM)
+                    self.pause() # MusicPlayer state change
                 raise Exit(text)
 
         return state
@@ -0,0 +1,87 @@
+from typing import Dict, Optional
+import audioop
+import math
+import threading
+
+import numpy as np
+
+__all__ = ["NoiseFloorTracker"]
+
+
+class NoiseFloorTracker:
+    """
+    Continuously estimates the background energy from the live stream
+    and keeps recognizer.energy_threshold up to date, replacing the
+    blocking per-listen adjust_for_ambient_noise.
+
+    Every chunk's RMS goes into a fixed size history; every update_interval
+    seconds a low percentile of that history (the noise floor) times the
+    profile's ratio is blended into the threshold with an EMA.
+
+    Profiles keep separate thresholds for separate noise regimes,
+    e.g. "quiet" and "music" (while a MusicPlayer is playing).
+    """
+    def __init__(
+            self,
+            recognizer,
+            seconds_per_buffer: float,
+            history_seconds: float = 10.,
+            percentile: float = 15.,
+            time_constant: float = 3.,
+            update_interval: float = .5,
+            min_threshold: float = 50.,
+            ratios: Optional[Dict[str, float]] = None,
+        ):
+        self.recognizer = recognizer
+        self.percentile = percentile
+        self.min_threshold = min_threshold
+        # threshold = ratio * noise floor, per profile
+        self.ratios = ratios if ratios is not None else {"quiet": 1.5, "music": 2.5}
+        self.thresholds: Dict[str, float] = {}
+        self.profile = "quiet"
+
+        self._energies = np.zeros(int(math.ceil(history_seconds / seconds_per_buffer)), dtype=np.float32)
+        self._pos = 0
+        self._count = 0 # chunks seen in the current profile
+        self._update_every = max(1, int(round(update_interval / seconds_per_buffer)))
+        # only estimate once a second of audio is there
+        self._warmup = max(self._update_every, int(math.ceil(1. / seconds_per_buffer)))
+        self._alpha = 1 - math.exp(-update_interval / time_constant)
+        self._lock = threading.Lock()
+
+    @property
+    def threshold(self) -> float:
+        return self.recognizer.energy_threshold
+
+    def set_profile(self, profile: str) -> None:
+        assert profile in self.ratios, f"unknown noise profile {profile}, choose from {list(self.ratios)}"
+        with self._lock:
+            if profile == self.profile:
+                return
+            self.profile = profile
+            # history belongs to the old noise regime
+            self._pos = self._count = 0
+            if profile in self.thresholds:
+                self.recognizer.energy_threshold = self.thresholds[profile]
+
+    def update(self, buffer: bytes, sample_width: int) -> None:
+        """Feed one captured chunk (called from the capture thread)."""
+        energy = audioop.rms(buffer, sample_width)
+        with self._lock:
+            self._energies[self._pos] = energy
+            self._pos = (self._pos + 1) % len(self._energies)
+            self._count += 1
+            if self._count >= self._warmup and self._count % self._update_every == 0:
+                self._estimate()
+
+    def _estimate(self) -> None:
+        history = self._energies[:min(self._count, len(self._energies))]
+        floor = float(np.percentile(history, self.percentile))
+        target = max(floor * self.ratios[self.profile], self.min_threshold)
+        current = self.thresholds.get(self.profile)
+        if current is None:
+            threshold = target
+        else:
+            threshold = current + self._alpha * (target - current)
+        self.thresholds[self.profile] = threshold
+        self.recognizer.energy_threshold = threshold
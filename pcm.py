@@ -0,0 +1,146 @@
+from typing import Optional, Tuple, Union
+import struct
+
+import numpy as np
+import torch
+
+__all__ = ["PCMFrame", "normalize", "read_wav", "SAMPLE_DTYPES"]
+
+"""
+One numeric representation of audio for capture, resampling, inference and training:
+
+* on the wire (pyaudio, audioop, wav files) audio is interleaved integer PCM
+* everything downstream sees float32 in [-1, 1), channels first,
+  scaled exactly like torchaudio.load(normalize=True) does it
+"""
+
+# sample width in bytes -> numpy dtype of a single sample
+SAMPLE_DTYPES = {
+    1: np.uint8, # 8 bit wav is unsigned
+    2: np.int16,
+    4: np.int32,
+}
+
+# dtype -> (scale, offset) such that float = int * scale + offset
+_NORMALIZATION = {
+    np.dtype(np.uint8): (1. / 128, -1.),
+    np.dtype(np.int16): (1. / 32768, 0.),
+    np.dtype(np.int32): (1. / 2147483648, 0.),
+    np.dtype(np.float32): (1., 0.),
+    np.dtype(np.float64): (1., 0.),
+}
+
+
+WAVE_FORMAT_PCM = 1
+WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+
+
+def read_wav(path: str) -> Tuple[bytes, int, int, int]:
+    """(interleaved PCM frames, sample rate, sample width, channels) of a PCM WAV file,
+    also WAVE_FORMAT_EXTENSIBLE ones (the dataset's 32 bit recordings) which the wave module rejects"""
+    with open(path, "rb") as f:
+        data = f.read()
+    assert data[:4] == b"RIFF" and data[8:12] == b"WAVE", f"{path} is not a WAV file"
+    fmt, frames = None, None
+    i = 12
+    while i + 8 <= len(data):
+        chunk_id, size = data[i:i+4], struct.unpack("<I", data[i+4:i+8])[0]
+        body = data[i+8:i+8+size]
+        if chunk_id == b"fmt ":
+            fmt = struct.unpack("<HHIIHH", body[:16])
+            if fmt[0] == WAVE_FORMAT_EXTENSIBLE:
+                # sub format GUID starts with the actual format tag
+                fmt = (struct.unpack("<H", body[24:26])[0],) + fmt[1:]
+        elif chunk_id == b"data":
+            frames = body
+        i += 8 + size + (size & 1)
+    assert fmt is not None and frames is not None, f"{path} has no fmt or data chunk"
+    tag, channels, sample_rate, _, _, bits = fmt
+    assert tag == WAVE_FORMAT_PCM, f"{path}: only integer PCM is supported, got format {tag}"
+    return frames, sample_rate, bits // 8, channels
+
+
+def normalize(samples: np.ndarray, out: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    Vectorized int PCM -> float32 conversion.
+    samples: (n, channels) interleaved; returns (channels, n).
+    If out is given, the result is written into it without temporaries.
+    """
+    scale, offset = _NORMALIZATION[samples.dtype]
+    if out is None:
+        out = np.empty(samples.shape[::-1], dtype=np.float32)
+    np.multiply(samples.T, scale, out=out, casting="unsafe")
+    if offset:
+        np.add(out, offset, out=out)
+    return out
+
+
+class PCMFrame:
+    """
+    A chunk of PCM audio plus its format (sample width, channels, rate).
+
+    Wraps raw bytes (pyaudio/audioop fragments) or an already decoded
+    integer array without copying; samples, to_float and to_tensor are views
+    or single vectorized conversions of the same memory.
+    """
+    def __init__(
+            self,
+            data: Union[bytes, bytearray, memoryview, np.ndarray],
+            sample_width: int = 2,
+            channels: int = 1,
+            sample_rate: int = 16000,
+        ):
+        self.sample_width = int(sample_width)
+        self.channels = int(channels)
+        self.sample_rate = int(sample_rate)
+
+        if isinstance(data, np.ndarray):
+            samples = data
+        else:
+            samples = np.frombuffer(data, dtype=SAMPLE_DTYPES[self.sample_width])
+        self._samples = samples.reshape(-1, self.channels)
+
+    @classmethod
+    def from_array(cls, array: np.ndarray, sample_rate: int, channels_first: bool = False) -> "PCMFrame":
+        """e.g. PCMFrame.from_array(torchaudio.load(f, normalize=False)[0].numpy(), sr, channels_first=True)"""
+        if array.ndim == 1:
+            array = array[:, None]
+        elif channels_first:
+            array = array.T
+        return cls(array, array.dtype.itemsize, array.shape[1], sample_rate)
+
+    @classmethod
+    def from_wav(cls, path: str) -> "PCMFrame":
+        """integer PCM WAV file, without torchaudio (see read_wav)"""
+        data, sample_rate, sample_width, channels = read_wav(path)
+        return cls(data, sample_width, channels, sample_rate)
+
+    @property
+    def samples(self) -> np.ndarray:
+        """Zero-copy (n, channels) view of the raw samples."""
+        return self._samples
+
+    @property
+    def dtype(self) -> np.dtype:
+        return self._samples.dtype
+
+    def __len__(self) -> int:
+        return self._samples.shape[0]
+
+    @property
+    def duration(self) -> float:
+        return len(self) / self.sample_rate
+
+    def tobytes(self) -> bytes:
+        return self._samples.tobytes()
+
+    def to_float(self, out: Optional[np.ndarray] = None) -> np.ndarray:
+        """(channels, n) float32 in [-1, 1)"""
+        return normalize(self._samples, out=out)
+
+    def to_tensor(self, out: Optional[np.ndarray] = None) -> torch.Tensor:
+        """(channels, n) float32 tensor sharing memory with to_float's result"""
+        return torch.from_numpy(self.to_float(out=out))
+
+    def __repr__(self):
+        return f"PCMFrame(n={len(self)}, width={self.sample_width}, channels={self.channels}, rate={self.sample_rate})"
@@ -0,0 +1,259 @@
+from typing import List, Optional, Sequence, Tuple, Union
+import audioop
+import contextlib
+import os
+import stat
+import sys
+import tempfile
+import time
+
+import speech_recognition as sr
+
+from capture import MicrophoneSession
+from pcm import read_wav
+
+__all__ = ["read_wav", "load_wav", "keyword_transcript", "ReplaySession", "LocalSTT", "fake_audio_tools"]
+
+"""
+Offline stand-ins for hal's inputs and outputs, to run the whole
+listen -> wake -> recognize -> _parse_choice -> respond path without
+a microphone, network or sound card:
+
+* ReplaySession: MicrophoneSession that streams WAV files (e.g. wavs/,
+  data/hal_keywords/) in real time, faster, or as fast as listeners read
+* LocalSTT: speech to text backend answering with the transcripts of the
+  files the last utterance came from
+* fake_audio_tools: say, aplay, mpg123 and amixer replaced by small
+  scripts that only take the time the real ones would
+
+turn_bench.py puts them together into an end-to-end latency benchmark.
+"""
+
+def _convert(frames: bytes, sample_rate: int, sample_width: int, channels: int,
+        out_rate: int, out_width: int) -> bytes:
+    """mono PCM at out_rate/out_width, like sr.AudioData.get_raw_data does it"""
+    if sample_width == 1:
+        frames = audioop.bias(frames, 1, -128) # WAV 8 bit is unsigned
+    if channels > 1:
+        frames = _mix(frames, sample_width, channels)
+    if sample_rate != out_rate:
+        frames, _ = audioop.ratecv(frames, sample_width, 1, sample_rate, out_rate, None)
+    if sample_width != out_width:
+        frames = audioop.lin2lin(frames, sample_width, out_width)
+    return frames
+
+
+def _mix(frames: bytes, width: int, channels: int) -> bytes:
+    """average of all channels"""
+    if channels == 2:
+        return audioop.tomono(frames, width, .5, .5)
+    # pick every channel's samples out of the interleaved frames and average them
+    frame_size = width * channels
+    mixed = None
+    for c in range(channels):
+        samples = b"".join(frames[j:j+width] for j in range(c * width, len(frames), frame_size))
+        samples = audioop.mul(samples, width, 1. / channels)
+        mixed = samples if mixed is None else audioop.add(mixed, samples, width)
+    return mixed
+
+
+def load_wav(path: str, sample_rate: int = 16000, sample_width: int = 2) -> bytes:
+    """mono sample_width PCM at sample_rate of the WAV file at path"""
+    return _convert(*read_wav(path), sample_rate, sample_width)
+
+
+def keyword_transcript(path: str) -> Optional[str]:
+    """data/hal_keywords/hey_hal/3.wav -> "hey hal"; None for files outside the keyword dataset"""
+    label_dir = os.path.dirname(os.path.abspath(path))
+    if os.path.basename(os.path.dirname(label_dir)) != "hal_keywords":
+        return None
+    return os.path.basename(label_dir).replace("_", " ")
+
+
+class ReplaySession(MicrophoneSession):
+    """
+    MicrophoneSession replaying a playlist of WAV files instead of reading a device,
+    converted to mono sample_width PCM at sample_rate.
+
+    playlist: paths or (path, transcript) pairs; without a transcript, keyword_transcript(path)
+    speed: 1.0 is real time, 4.0 four times faster; None replays as fast as listeners
+        read it and pauses while nobody listens (hal talking or responding),
+        so no audio is lost or skipped and runs are reproducible
+    lead_seconds / gap_seconds: silence before the first file and after every file,
+        so the noise floor settles and phrases end
+    After the last file (and its gap) the session stops, ending every open listen.
+    """
+    def __init__(
+            self,
+            playlist: Sequence[Union[str, Tuple[str, Optional[str]]]],
+            sample_rate: int = 16000,
+            sample_width: int = 2,
+            chunk_size: int = 1024,
+            preroll_seconds: float = 3.0,
+            speed: Optional[float] = 1.0,
+            lead_seconds: float = 1.0,
+            gap_seconds: float = 1.0,
+        ):
+        self.microphone = None
+        self.SAMPLE_RATE = sample_rate
+        self.SAMPLE_WIDTH = sample_width
+        self.CHUNK = chunk_size
+        self.format = None
+        self._init_history(preroll_seconds)
+        self.speed = speed
+
+        self.paths: List[str] = []
+        self.transcripts: List[Optional[str]] = []
+        # all chunks to replay and the playlist index each belongs to (-1: silence)
+        self._replay: List[bytes] = []
+        self._replay_file: List[int] = []
+        chunk_bytes = chunk_size * sample_width
+        self._add_silence(lead_seconds)
+        for item in playlist:
+            path, transcript = (item, keyword_transcript(item)) if isinstance(item, str) else item
+            frames = load_wav(path, sample_rate, sample_width)
+            index = len(self.paths)
+            self.paths.append(path)
+            self.transcripts.append(transcript)
+            for start in range(0, len(frames), chunk_bytes):
+                self._replay.append(frames[start:start + chunk_bytes].ljust(chunk_bytes, b"\0"))
+                self._replay_file.append(index)
+            self._add_silence(gap_seconds)
+        # perf_counter time at which each file's last chunk was captured
+        self.file_end_times: List[Optional[float]] = [None] * len(self.paths)
+        # chunks handed to listeners so far (sequence number of the next unread one)
+        self.read_upto = 0
+        self._next = 0
+        self._t0 = None
+
+    def _add_silence(self, seconds: float) -> None:
+        n = int(round(seconds / self.seconds_per_buffer))
+        self._replay += [b"\0" * (self.CHUNK * self.SAMPLE_WIDTH)] * n
+        self._replay_file += [-1] * n
+
+    @property
+    def duration(self) -> float:
+        """seconds of audio in the whole replay"""
+        return len(self._replay) * self.seconds_per_buffer
+
+    @property
+    def finished(self) -> bool:
+        """everything was replayed and read (or skipped)"""
+        return self._next >= len(self._replay) and not self.running and self._consumed >= self._captured
+
+    def _open(self) -> None:
+        self._t0 = time.perf_counter()
+
+    def _close(self) -> None:
+        return
+
+    def _read(self) -> bytes:
+        if self._next >= len(self._replay):
+            return b""
+        if self.speed:
+            # pace chunks like a device delivering them at speed x real time
+            due = self._t0 + self._next * self.seconds_per_buffer / self.speed
+            delay = due - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        else:
+            # lossless: next chunk only once a listener read (or skipped) all earlier ones
+            with self._cond:
+                while self._running and self._captured > self._consumed:
+                    self._cond.wait()
+        buffer = self._replay[self._next]
+        index = self._replay_file[self._next]
+        self._next += 1
+        if index >= 0 and (self._next >= len(self._replay) or self._replay_file[self._next] != index):
+            self.file_end_times[index] = time.perf_counter()
+        return buffer
+
+    def read_chunk(self, position: int):
+        buffer, position = super().read_chunk(position)
+        with self._cond:
+            self.read_upto = max(self.read_upto, position)
+            # a waiting lossless capture may go on
+            self._cond.notify_all()
+        return buffer, position
+
+    def skip(self) -> None:
+        super().skip()
+        with self._cond:
+            self._cond.notify_all()
+
+    def heard(self, start: int, end: int) -> List[int]:
+        """playlist indices of the files with chunks among the captured chunks start..end-1"""
+        # captured chunk n is _replay[n]
+        files = []
+        for index in self._replay_file[start:end]:
+            if index >= 0 and index not in files:
+                files.append(index)
+        return files
+
+
+class LocalSTT:
+    """
+    Speech to text stand-in for a ReplaySession (VoiceControlledAutomaton(stt=...)):
+    answers with the transcripts of the files read by listeners since the last call,
+    so what hal "hears" is what the playlist says, without network or model.
+    delay simulates the backend's round trip.
+    """
+    def __init__(self, session: ReplaySession, delay: float = 0.):
+        self.session = session
+        self.delay = delay
+        self._position = 0
+        self.last_files: List[int] = []
+
+    def __call__(self, audio: sr.AudioData) -> str:
+        if self.delay:
+            time.sleep(self.delay)
+        end = self.session.read_upto
+        self.last_files = self.session.heard(self._position, end)
+        self._position = end
+        words = [self.session.transcripts[i] for i in self.last_files if self.session.transcripts[i]]
+        if not words:
+            raise sr.UnknownValueError()
+        return " ".join(words)
+
+
+_FAKE_TOOL = """#!{python}
+# stand-in for {name} (replay.fake_audio_tools): only takes the time the real one would
+import os, struct, sys, time
+args = [a for a in sys.argv[1:] if not a.startswith("-")]
+speed = {speed}
+if "{name}" == "say":
+    time.sleep(len(" ".join(args)) * {seconds_per_char} / speed)
+elif "{name}" == "amixer":
+    print("Simple mixer control 'Master',0\\n  Mono: Playback 32768 [50%] [on]")
+elif args and args[-1].endswith(".wav") and os.path.exists(args[-1]):
+    with open(args[-1], "rb") as f:
+        header = f.read(64)
+    byte_rate = struct.unpack("<I", header[28:32])[0]
+    time.sleep(max(0, os.path.getsize(args[-1]) - 44) / max(byte_rate, 1) / speed)
+else:
+    time.sleep({other_seconds} / speed)
+"""
+
+
+@contextlib.contextmanager
+def fake_audio_tools(seconds_per_char: float = .06, other_seconds: float = 1., speed: float = 1.,
+        tools: Sequence[str] = ("say", "aplay", "mpg123", "amixer")):
+    """
+    Put scripts named like hal's audio tools in front of PATH for the duration:
+    say sleeps per character of text, aplay for the WAV's duration,
+    mpg123 (and aplay on anything else) for other_seconds, amixer prints a volume.
+    speed divides all durations, like ReplaySession's.
+    """
+    old_path = os.environ.get("PATH", "")
+    with tempfile.TemporaryDirectory(prefix="hal-fake-tools-") as bin_dir:
+        for name in tools:
+            path = os.path.join(bin_dir, name)
+            with open(path, "w") as f:
+                f.write(_FAKE_TOOL.format(python=sys.executable, name=name, speed=float(speed),
+                    seconds_per_char=seconds_per_char, other_seconds=other_seconds))
+            os.chmod(path, os.stat(path).st_mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
+        os.environ["PATH"] = bin_dir + os.pathsep + old_path
+        try:
+            yield bin_dir
+        finally:
+            os.environ["PATH"] = old_path
@@ -0,0 +1,124 @@
+from typing import Tuple
+import functools
+import math
+
+import torch
+import torch.nn.functional as F
+
+__all__ = ["PolyphaseResampler", "resample"]
+
+"""
+Windowed sinc polyphase resampling, the same filter torchaudio's
+Resample uses by default (hann window, lowpass_filter_width=6, rolloff=0.99),
+with the filter bank computed once per (orig, new) rate pair.
+
+One PolyphaseResampler serves both
+* batches of training clips: resampler(waveforms), stateless
+* live audio: resampler.push(chunk) chunk by chunk, keeping the filter
+  history between calls, so the concatenated output equals resampler(all chunks)
+  (up to the tail, which flush() returns)
+"""
+
+LOWPASS_FILTER_WIDTH = 6
+ROLLOFF = 0.99
+
+
+@functools.lru_cache(maxsize=None)
+def _filter_bank(orig_freq: int, new_freq: int) -> Tuple[torch.Tensor, int]:
+    """(new_freq, 1, 2 * width + orig_freq) polyphase kernels for the reduced rate pair, and width."""
+    base_freq = min(orig_freq, new_freq) * ROLLOFF
+    width = math.ceil(LOWPASS_FILTER_WIDTH * orig_freq / base_freq)
+    idx = torch.arange(-width, width + orig_freq, dtype=torch.float64)[None, None] / orig_freq
+    t = torch.arange(0, -new_freq, -1, dtype=torch.float64)[:, None, None] / new_freq + idx
+    t *= base_freq
+    t = t.clamp_(-LOWPASS_FILTER_WIDTH, LOWPASS_FILTER_WIDTH)
+    window = torch.cos(t * math.pi / LOWPASS_FILTER_WIDTH / 2) ** 2
+    t *= math.pi
+    kernels = torch.where(t == 0, torch.ones_like(t), t.sin() / t)
+    kernels *= window * (base_freq / orig_freq)
+    return kernels.to(torch.float32), width
+
+
+class PolyphaseResampler:
+    def __init__(self, orig_freq: int, new_freq: int):
+        gcd = math.gcd(int(orig_freq), int(new_freq))
+        self.orig_freq = int(orig_freq)
+        self.new_freq = int(new_freq)
+        # reduced rates: every orig input samples yield new output samples
+        self._orig = self.orig_freq // gcd
+        self._new = self.new_freq // gcd
+        if self._orig != self._new:
+            self.kernel, self.width = _filter_bank(self._orig, self._new)
+        self.reset()
+
+    @property
+    def identity(self) -> bool:
+        return self._orig == self._new
+
+    def _convolve(self, padded: torch.Tensor) -> torch.Tensor:
+        # (batch, time) -> (batch, frames * new)
+        out = F.conv1d(padded[:, None], self.kernel, stride=self._orig)
+        return out.transpose(1, 2).reshape(padded.shape[0], -1)
+
+    def __call__(self, waveform: torch.Tensor) -> torch.Tensor:
+        """Resample (..., time) in one go."""
+        if self.identity:
+            return waveform
+        shape = waveform.shape
+        length = shape[-1]
+        x = waveform.reshape(-1, length)
+        x = F.pad(x, (self.width, self.width + self._orig))
+        out = self._convolve(x)
+        target_length = math.ceil(self._new * length / self._orig)
+        return out[..., :target_length].reshape(*shape[:-1], target_length)
+
+    def reset(self) -> None:
+        """Forget the streaming history (e.g. at the start of a new utterance)."""
+        self._history = None
+        self._consumed = 0 # input samples pushed so far
+        self._emitted = 0 # output samples returned so far
+
+    def push(self, chunk: torch.Tensor) -> torch.Tensor:
+        """
+        Resample the next (channels, time) chunk of a stream.
+        Returns the (channels, m) output samples that are fully determined so far.
+        """
+        if self.identity:
+            return chunk
+        if self._history is None:
+            # same implicit left zero padding as the batch version
+            self._history = chunk.new_zeros(chunk.shape[0], self.width)
+        buf = torch.cat([self._history, chunk], dim=-1)
+        self._consumed += chunk.shape[-1]
+
+        span = 2 * self.width + self._orig
+        if buf.shape[-1] < span:
+            self._history = buf
+            return chunk.new_zeros(chunk.shape[0], 0)
+        frames = (buf.shape[-1] - span) // self._orig + 1
+        out = self._convolve(buf[:, :(frames - 1) * self._orig + span])
+        self._history = buf[:, frames * self._orig:]
+        self._emitted += out.shape[-1]
+        return out
+
+    def flush(self) -> torch.Tensor:
+        """Remaining output of the stream (right zero padded like the batch version), then reset."""
+        if self.identity or self._history is None:
+            self.reset()
+            return torch.zeros(0)
+        channels = self._history.shape[0]
+        target_length = math.ceil(self._new * self._consumed / self._orig)
+        out = self.push(self._history.new_zeros(channels, self.width + self._orig))
+        out = out[:, :max(0, target_length - (self._emitted - out.shape[-1]))]
+        self.reset()
+        return out
+
+
+@functools.lru_cache(maxsize=None)
+def _resampler(orig_freq: int, new_freq: int) -> PolyphaseResampler:
+    return PolyphaseResampler(orig_freq, new_freq)
+
+
+def resample(waveform: torch.Tensor, orig_freq: int, new_freq: int) -> torch.Tensor:
+    """Stateless (..., time) resampling with the cached filter bank for this rate pair."""
+    return _resampler(int(orig_freq), int(new_freq))(waveform)
@@ -0,0 +1,158 @@
+from typing import Dict, List, Optional, Sequence, Tuple, Union
+import os
+
+import numpy as np
+import torch
+from torch.utils.data import Dataset
+
+from resample import resample
+
+__all__ = ["ResampledDataset", "CACHE_COLUMNS"]
+
+"""
+Resample-once cache of the keyword dataset: every clip resampled to the
+training rate a single time and appended to one float32 file per rate
+(data/hal_keywords_cache/resampled_8000.f32) with its index next to it
+(resampled_8000.npz). Entries are keyed by (clip path, rate) and reused as
+long as the clip's length and sample rate in the source dataset are unchanged;
+HAL_KW_DATASET and PackedDataset work as sources alike.
+
+ResampledDataset then serves whole batches: dataset[[i, j, ...]] copies the
+clips straight from the memory mapped file into one zeroed batch tensor and
+looks the labels up in a precomputed int64 array.
+"""
+
+CACHE_COLUMNS = ("path", "source_samples", "source_rate", "offset", "num_frames", "channels")
+
+
+class ResampledDataset(Dataset):
+    """
+    dataset (HAL_KW_DATASET or PackedDataset) resampled to sample_rate, cached under cache_dir.
+    dataset[n] is an item like the source's (waveform, sample_rate, label, utterance_number),
+    dataset[indices] a padded batch (waveforms (batch, channels, time), targets (batch,)),
+    e.g. for DataLoader(dataset, batch_size=None, sampler=BatchSampler(...)).
+    length: batches of exactly length samples, longer clips cut around their middle;
+        None pads to the longest clip of each batch
+    """
+    def __init__(self, dataset: Dataset, sample_rate: int, cache_dir: str, length: Optional[int] = None) -> None:
+        self.sample_rate = int(sample_rate)
+        self.length = length
+        self._index_path = os.path.join(cache_dir, f"resampled_{self.sample_rate}.npz")
+        self._data_path = os.path.join(cache_dir, f"resampled_{self.sample_rate}.f32")
+        os.makedirs(cache_dir, exist_ok=True)
+
+        self._labels: List[str] = list(dataset.labels)
+        self._label_to_index: Dict[str, int] = dict(dataset.label_to_index)
+        self.paths = np.asarray(dataset.paths)
+        self._targets = np.asarray(dataset.targets, dtype=np.int64)
+        columns = self._update(dataset)
+        self._offset = columns["offset"]
+        self._frames = columns["num_frames"]
+        self._channels = columns["channels"]
+        self._data: Optional[np.memmap] = None
+
+    def _load_index(self) -> Dict[str, np.ndarray]:
+        if not os.path.exists(self._index_path):
+            return {c: np.array([], dtype=str if c == "path" else np.int64) for c in CACHE_COLUMNS}
+        with np.load(self._index_path, allow_pickle=False) as index:
+            return {c: index[c] for c in CACHE_COLUMNS}
+
+    def _update(self, dataset: Dataset) -> Dict[str, np.ndarray]:
+        """cache columns of dataset's clips, in dataset order; resamples and appends the ones missing"""
+        index = self._load_index()
+        rows = {p: i for i, p in enumerate(index["path"].tolist())}
+        source_samples = np.asarray(dataset.num_samples)
+        source_rates = np.asarray(dataset.sample_rates)
+        selected = np.empty(len(dataset), dtype=np.int64)
+        missing = []
+        for n, path in enumerate(self.paths.tolist()):
+            i = rows.get(path)
+            if i is not None and index["source_samples"][i] == source_samples[n] \
+                    and index["source_rate"][i] == source_rates[n]:
+                selected[n] = i
+            else:
+                missing.append(n)
+
+        if missing:
+            new = {c: [] for c in CACHE_COLUMNS}
+            with open(self._data_path, "ab") as f:
+                offset = f.tell() // 4
+                for k, n in enumerate(missing):
+                    waveform, rate, *_ = dataset[n]
+                    out = np.ascontiguousarray(resample(waveform, rate, self.sample_rate).numpy(), dtype=np.float32)
+                    f.write(out.tobytes())
+                    for column, value in zip(CACHE_COLUMNS, (
+                            self.paths[n], source_samples[n], rate, offset, out.shape[-1], out.shape[0])):
+                        new[column].append(value)
+                    # a changed clip gets a new entry, its old samples are left unused
+                    rows[self.paths[n]] = len(index["path"]) + k
+                    selected[n] = rows[self.paths[n]]
+                    offset += out.size
+            index = {c: np.concatenate([index[c], np.array(new[c], dtype=index[c].dtype if c != "path" else str)])
+                for c in CACHE_COLUMNS}
+            tmp = self._index_path + ".tmp.npz"
+            np.savez(tmp, **index)
+            os.replace(tmp, self._index_path)
+            print(f"Resampled {len(missing)} clips to {self.sample_rate} Hz into {self._data_path}")
+        return {c: index[c][selected] for c in CACHE_COLUMNS if c != "path"}
+
+    def __getstate__(self):
+        # DataLoader workers map the cache themselves
+        state = self.__dict__.copy()
+        state["_data"] = None
+        return state
+
+    def data(self) -> np.memmap:
+        if self._data is None:
+            self._data = np.memmap(self._data_path, dtype=np.float32, mode="r")
+        return self._data
+
+    @property
+    def labels(self) -> List[str]:
+        return self._labels
+
+    @property
+    def label_to_index(self) -> Dict[str, int]:
+        return self._label_to_index
+
+    @property
+    def targets(self) -> np.ndarray:
+        return self._targets
+
+    @property
+    def num_samples(self) -> np.ndarray:
+        """length of every item in samples at sample_rate"""
+        return self._frames
+
+    @property
+    def sample_rates(self) -> np.ndarray:
+        return np.full(len(self), self.sample_rate, dtype=np.int64)
+
+    def batch(self, indices: Sequence[int]) -> Tuple[torch.Tensor, torch.Tensor]:
+        """(batch, channels, longest or length) zero padded waveforms and (batch,) int64 targets of the items at indices"""
+        indices = np.asarray(indices, dtype=np.int64)
+        offset, frames = self._offset[indices], self._frames[indices]
+        channels = int(self._channels[indices[0]])
+        assert (self._channels[indices] == channels).all(), "can't batch clips with different channel counts"
+        size = int(frames.max()) if self.length is None else self.length
+        # first sample of each clip that goes into the batch (center crop)
+        skip = np.maximum(frames - size, 0) // 2
+        waveforms = torch.zeros(len(indices), channels, size)
+        # one memcpy per clip from the page cache, no per item tensors or padding temporaries
+        out, data = waveforms.numpy(), self.data()
+        for b, (start, length, first) in enumerate(zip(offset.tolist(), frames.tolist(), skip.tolist())):
+            taken = min(length, size)
+            out[b, :, :taken] = data[start:start + channels * length].reshape(channels, length)[:, first:first + taken]
+        return waveforms, torch.from_numpy(self._targets[indices])
+
+    def __getitem__(self, n: Union[int, Sequence[int]]):
+        if not isinstance(n, (int, np.integer)):
+            return self.batch(n)
+        offset, frames, channels = int(self._offset[n]), int(self._frames[n]), int(self._channels[n])
+        waveform = torch.from_numpy(np.array(self.data()[offset:offset + frames * channels]).reshape(channels, frames))
+        path = str(self.paths[n])
+        utterance = int(os.path.basename(path).split(".")[0])
+        return waveform, self.sample_rate, self._labels[self._targets[n]], utterance
+
+    def __len__(self) -> int:
+        return len(self.paths)
@@ -0,0 +1,94 @@
+from typing import Optional
+
+import numpy as np
+import torch
+
+from pcm import PCMFrame, normalize
+
+__all__ = ["AudioRingBuffer"]
+
+
+class AudioRingBuffer:
+    """
+    Preallocated mono float32 ring buffer for live audio.
+
+    Samples are stored twice (at i and i + capacity), so the most recent
+    n <= capacity samples always form one contiguous slice; latest(n) hands
+    that slice out as a torch view without copying.
+
+    NOTE
+    Views returned by latest() alias the storage and are only valid
+    until the next write.
+    """
+    def __init__(self, capacity: int, sample_rate: int, storage: Optional[np.ndarray] = None):
+        assert capacity > 0, "capacity must be positive"
+        self.capacity = int(capacity)
+        self.sample_rate = int(sample_rate)
+        if storage is None:
+            storage = np.zeros(2 * self.capacity, dtype=np.float32)
+        assert storage.dtype == np.float32 and storage.shape == (2 * self.capacity,)
+        self._data = storage
+        self._tensor = torch.from_numpy(self._data)
+        self._pos = 0 # next write index in [0, capacity)
+        self.written = 0 # total number of samples ever written
+
+    def __len__(self) -> int:
+        return min(self.written, self.capacity)
+
+    def ms_to_samples(self, ms: float) -> int:
+        return int(round(self.sample_rate * ms / 1000))
+
+    def _store(self, start: int, stop: int, samples: np.ndarray):
+        # write into both mirrored halves, converting to float32 in place
+        normalize(samples[:, None], out=self._data[None, start:stop])
+        self._data[start+self.capacity:stop+self.capacity] = self._data[start:stop]
+
+    def write(self, samples: np.ndarray) -> None:
+        """Append mono samples of any PCM dtype (see pcm.normalize) or float32."""
+        n = len(samples)
+        if n == 0:
+            return
+        total = n
+        if n > self.capacity:
+            # only the newest samples survive anyway
+            samples = samples[-self.capacity:]
+            n = self.capacity
+
+        end = self._pos + n
+        if end <= self.capacity:
+            self._store(self._pos, end, samples)
+        else:
+            first = self.capacity - self._pos
+            self._store(self._pos, self.capacity, samples[:first])
+            self._store(0, n - first, samples[first:])
+        self._pos = end % self.capacity
+        # publish only after the samples are in place (readers may poll written)
+        self.written += total
+
+    def write_frame(self, frame: PCMFrame) -> None:
+        assert frame.sample_rate == self.sample_rate, \
+            f"ring holds {self.sample_rate} Hz audio, got {frame.sample_rate} Hz"
+        if frame.channels == 1:
+            self.write(frame.samples[:, 0])
+        else:
+            # downmix
+            self.write(frame.to_float().mean(axis=0, dtype=np.float32))
+
+    def write_bytes(self, buffer: bytes, sample_width: int = 2) -> None:
+        """Append a mono PCM fragment without intermediate copies."""
+        self.write_frame(PCMFrame(buffer, sample_width, 1, self.sample_rate))
+
+    def latest(self, n: int, offset: int = 0) -> torch.Tensor:
+        """
+        Zero-copy view of n samples, oldest first,
+        ending offset samples before the most recent one.
+        """
+        assert 0 < n and 0 <= offset and n + offset <= self.capacity, \
+            f"can only view up to {self.capacity} samples back, got {n} + {offset}"
+        end = self._pos + self.capacity - offset
+        return self._tensor[end-n:end]
+
+    def clear(self) -> None:
+        self._data.fill(0)
+        self._pos = 0
+        self.written = 0
@@ -0,0 +1,179 @@
+from typing import Dict, List, Optional, Tuple, Union
+from pathlib import Path
+import argparse
+import os
+
+import numpy as np
+import torch
+from torch.utils.data import Dataset
+
+from dataset import FOLDER_IN_ARCHIVE
+from manifest import SPLITS, DatasetManifest
+from pcm import PCMFrame
+
+__all__ = ["pack", "PackedDataset", "to_int16", "INDEX_NAME"]
+
+"""
+Packed keyword dataset: every clip of data/hal_keywords as int16 PCM in a
+few large shard files (data/hal_keywords_packed/shard_000.bin, ...) plus
+an offset index (index.npz, columns like manifest.DatasetManifest).
+
+    python shards.py --root data --shard-mb 256
+
+PackedDataset returns the same items as HAL_KW_DATASET, but reads them as
+np.memmap slices of the shards: no file is opened or decoded per item,
+and worker processes share the page cache instead of holding copies.
+Clips are stored at their own sample rate and channel count; 8 and 32 bit
+recordings are converted to 16 bit.
+"""
+
+INDEX_NAME = "index.npz"
+INDEX_COLUMNS = ("shard", "offset", "num_frames", "channels", "sample_rate", "label", "split", "utterance")
+
+
+def to_int16(samples: np.ndarray) -> np.ndarray:
+    """integer PCM of any width as int16 (keeping the top 16 bits)"""
+    if samples.dtype == np.int16:
+        return samples
+    if samples.dtype == np.uint8:
+        return ((samples.astype(np.int16) - 128) << 8)
+    if samples.dtype == np.int32:
+        return (samples >> 16).astype(np.int16)
+    raise ValueError(f"can't convert {samples.dtype} PCM to int16")
+
+
+def _shard_name(i: int) -> str:
+    return f"shard_{i:03d}.bin"
+
+
+def pack(
+        root: Union[str, Path] = "data",
+        folder_in_archive: str = FOLDER_IN_ARCHIVE,
+        out: Optional[str] = None,
+        shard_mb: float = 256,
+    ) -> str:
+    """pack all clips of the dataset (in manifest order) into shards under out; returns out"""
+    path = os.path.join(os.fspath(root), folder_in_archive)
+    out = out if out is not None else path + "_packed"
+    os.makedirs(out, exist_ok=True)
+    manifest = DatasetManifest.load(path)
+    shard_samples = int(shard_mb * 2 ** 20) // 2
+
+    columns: Dict[str, List[int]] = {c: [] for c in INDEX_COLUMNS}
+    shard, offset = 0, 0
+    f = open(os.path.join(out, _shard_name(shard)), "wb")
+    try:
+        for row, clip in enumerate(manifest.path):
+            frame = PCMFrame.from_wav(os.path.join(path, clip))
+            samples = to_int16(frame.samples)
+            if offset and offset + samples.size > shard_samples:
+                f.close()
+                shard, offset = shard + 1, 0
+                f = open(os.path.join(out, _shard_name(shard)), "wb")
+            f.write(np.ascontiguousarray(samples).tobytes())
+            for column, value in zip(INDEX_COLUMNS, (
+                    shard, offset, len(frame), frame.channels, frame.sample_rate,
+                    manifest.label[row], manifest.split[row], int(os.path.basename(clip).split(".")[0]))):
+                columns[column].append(value)
+            offset += samples.size
+    finally:
+        f.close()
+
+    tmp = os.path.join(out, INDEX_NAME + ".tmp.npz")
+    np.savez(
+        tmp,
+        labels=np.array(manifest.labels, dtype=str),
+        path=manifest.path,
+        shards=np.array([_shard_name(i) for i in range(shard + 1)], dtype=str),
+        **{c: np.array(v, dtype=np.int64) for c, v in columns.items()},
+    )
+    os.replace(tmp, os.path.join(out, INDEX_NAME))
+    # shards left over from an earlier, larger packing
+    stale = shard + 1
+    while os.path.exists(os.path.join(out, _shard_name(stale))):
+        os.remove(os.path.join(out, _shard_name(stale)))
+        stale += 1
+    print(f"Packed {len(manifest)} clips into {shard + 1} shards under {out}")
+    return out
+
+
+class PackedDataset(Dataset):
+    """
+    HAL_KW_DATASET over packed shards (see pack): same items
+    (waveform, sample_rate, label, utterance_number), same labels/targets/num_samples.
+    The shards are memory mapped on first access in each process.
+    """
+    def __init__(self, path: Union[str, Path], subset: Optional[str] = None) -> None:
+        assert subset is None or subset in SPLITS
+        self._path = os.fspath(path)
+        with np.load(os.path.join(self._path, INDEX_NAME), allow_pickle=False) as index:
+            self._labels = [str(l) for l in index["labels"]]
+            self._shard_names = [str(s) for s in index["shards"]]
+            columns = {c: index[c] for c in INDEX_COLUMNS}
+            split = columns.pop("split")
+            rows = np.arange(len(split)) if subset is None else np.flatnonzero(split == SPLITS.index(subset))
+            self._index = {c: v[rows] for c, v in columns.items()}
+            self.paths = index["path"][rows]
+        self._label_to_index = {l: i for i, l in enumerate(self._labels)}
+        self._shards: Optional[List[np.memmap]] = None
+
+    def __getstate__(self):
+        # DataLoader workers map the shards themselves instead of receiving copies
+        state = self.__dict__.copy()
+        state["_shards"] = None
+        return state
+
+    def _shard(self, i: int) -> np.memmap:
+        if self._shards is None:
+            self._shards = [
+                np.memmap(os.path.join(self._path, name), dtype=np.int16, mode="r")
+                for name in self._shard_names]
+        return self._shards[i]
+
+    @property
+    def labels(self) -> List[str]:
+        return self._labels
+
+    @property
+    def label_to_index(self) -> Dict[str, int]:
+        return self._label_to_index
+
+    @property
+    def targets(self) -> np.ndarray:
+        return self._index["label"]
+
+    @property
+    def num_samples(self) -> np.ndarray:
+        return self._index["num_frames"]
+
+    @property
+    def sample_rates(self) -> np.ndarray:
+        return self._index["sample_rate"]
+
+    def raw(self, n: int) -> PCMFrame:
+        """the n-th clip as a zero-copy (frames, channels) int16 view into its shard"""
+        offset, frames, channels = (int(self._index[c][n]) for c in ("offset", "num_frames", "channels"))
+        samples = self._shard(int(self._index["shard"][n]))[offset:offset + frames * channels]
+        return PCMFrame(samples, 2, channels, int(self._index["sample_rate"][n]))
+
+    def __getitem__(self, n: int) -> Tuple[torch.Tensor, int, str, int]:
+        frame = self.raw(n)
+        label = self._labels[self._index["label"][n]]
+        return frame.to_tensor(), frame.sample_rate, label, int(self._index["utterance"][n])
+
+    def __len__(self) -> int:
+        return len(self.paths)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pack the keyword dataset into memory mapped int16 shards")
+    parser.add_argument("--root", default="data", help="directory holding the dataset folder")
+    parser.add_argument("--folder", default=FOLDER_IN_ARCHIVE)
+    parser.add_argument("--out", default=None, help="default: <root>/<folder>_packed")
+    parser.add_argument("--shard-mb", type=float, default=256)
+    args = parser.parse_args()
+    pack(args.root, args.folder, args.out, args.shard_mb)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,231 @@
+from typing import Dict, List, Optional, Sequence
+import argparse
+import datetime
+import glob
+import importlib
+import json
+import platform
+import random
+import time
+
+import numpy as np
+
+import automaton
+from automaton import VoiceControlledAutomaton
+from replay import LocalSTT, ReplaySession, fake_audio_tools
+
+__all__ = ["TurnRecorder", "run", "main"]
+
+"""
+End-to-end turn latency of the assistant, without microphone, network or speakers:
+
+    python turn_bench.py data/hal_keywords/hey_hal/*.wav data/hal_keywords/play/*.wav --speed 4 \
+        --output turns.json
+
+The automaton (hal9k:Hal9k by default) is built with a replay.ReplaySession
+streaming the WAV files as its capture, a replay.LocalSTT answering with
+their transcripts, and say/aplay/mpg123 replaced by replay.fake_audio_tools,
+then run until the playlist is exhausted. Every turn is split into
+
+    listen_s    listen call until it returns (waiting for speech included)
+    wake_s      listen start until the keyword model fired (--keyword only)
+    endpoint_s  end of the last heard file until listen returned (end of phrase detection;
+                negative if the file ends in silence the recognizer already counted as pause)
+    stt_s       speech to text call
+    respond_s   recognize (or listen, for keyword commands dispatched without
+                speech to text) returned until the next listen starts (_parse_choice, respond, say, ...)
+    turn_s      end of the last heard file until the next listen starts
+
+p50/p95 of every stage are printed and written to the JSON report.
+"""
+
+STAGES = ("listen_s", "wake_s", "endpoint_s", "stt_s", "respond_s", "turn_s")
+
+
+class ReplayFinished(Exception):
+    """raised from listen once the replay is over, ends VoiceControlledAutomaton.run"""
+
+
+class TurnRecorder:
+    """
+    Times the stages of every turn by wrapping VoiceControlledAutomaton's
+    listen/recognize (all sub automata go through them) and the recognizer's
+    wait_for_keyword, for as long as it is entered.
+    """
+    def __init__(self, session: ReplaySession, stt: LocalSTT):
+        self.session = session
+        self.stt = stt
+        self.turns: List[Dict[str, object]] = []
+        self._turn: Optional[Dict[str, object]] = None
+        self._saved = {}
+
+    def __enter__(self):
+        recorder = self
+        listen, recognize = VoiceControlledAutomaton.listen, VoiceControlledAutomaton.recognize
+
+        def timed_listen(vca, for_keyword=True):
+            now = time.perf_counter()
+            recorder._close_turn(now)
+            if recorder.session.finished:
+                raise ReplayFinished()
+            turn = recorder._turn = {"automaton": str(vca), "keyword": bool(for_keyword), "listen_start": now}
+            position = recorder.session.read_upto
+            audio = listen(vca, for_keyword)
+            turn["listen_end"] = time.perf_counter()
+            turn["files"] = recorder.session.heard(position, recorder.session.read_upto)
+            # dispatched without speech to text, see VoiceControlledAutomaton.get_utterance
+            turn["command"] = vca.R.keyword_command() if for_keyword else None
+            return audio
+
+        def timed_recognize(vca, audio):
+            start = time.perf_counter()
+            text = recognize(vca, audio)
+            if recorder._turn is not None:
+                recorder._turn.update(stt_start=start, stt_end=time.perf_counter(),
+                    text=text if isinstance(text, str) else None)
+            return text
+
+        self._saved = {"listen": listen, "recognize": recognize}
+        VoiceControlledAutomaton.listen = timed_listen
+        VoiceControlledAutomaton.recognize = timed_recognize
+        return self
+
+    def wrap_recognizer(self, recognizer) -> None:
+        """also time keyword detection of this recognizer (instance level, undone by __exit__)"""
+        wait_for_keyword = recognizer.wait_for_keyword
+        recorder = self
+
+        def timed_wait_for_keyword(*args, **kwargs):
+            result = wait_for_keyword(*args, **kwargs)
+            if recorder._turn is not None:
+                recorder._turn["wake"] = time.perf_counter()
+            return result
+
+        recognizer.wait_for_keyword = timed_wait_for_keyword
+        self._saved["recognizer"] = recognizer
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        VoiceControlledAutomaton.listen = self._saved["listen"]
+        VoiceControlledAutomaton.recognize = self._saved["recognize"]
+        if "recognizer" in self._saved:
+            del self._saved["recognizer"].wait_for_keyword
+        self._close_turn(time.perf_counter())
+
+    def _close_turn(self, next_listen: float) -> None:
+        turn, self._turn = self._turn, None
+        if turn is None or "listen_end" not in turn:
+            return
+        stages = {"listen_s": turn["listen_end"] - turn["listen_start"]}
+        if "wake" in turn:
+            stages["wake_s"] = turn["wake"] - turn["listen_start"]
+        if "stt_end" in turn:
+            stages["stt_s"] = turn["stt_end"] - turn["stt_start"]
+            stages["respond_s"] = next_listen - turn["stt_end"]
+        elif turn["command"] is not None:
+            stages["respond_s"] = next_listen - turn["listen_end"]
+        ends = [self.session.file_end_times[i] for i in turn["files"]]
+        if ends and ends[-1] is not None:
+            stages["endpoint_s"] = turn["listen_end"] - ends[-1]
+            stages["turn_s"] = next_listen - ends[-1]
+        self.turns.append({
+            "automaton": turn["automaton"],
+            "keyword": turn["keyword"],
+            "files": [self.session.paths[i] for i in turn["files"]],
+            "text": turn.get("text", turn["command"]),
+            "command": turn["command"] is not None,
+            **stages,
+        })
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        """count, p50 and p95 (seconds) of every stage over all turns"""
+        summary = {}
+        for stage in STAGES:
+            values = np.array([t[stage] for t in self.turns if stage in t])
+            if len(values):
+                p50, p95 = np.percentile(values, [50, 95])
+                summary[stage] = {"count": len(values), "p50": float(p50), "p95": float(p95)}
+        return summary
+
+
+def run(
+        playlist: Sequence[str],
+        factory: str = "hal9k:Hal9k",
+        speed: Optional[float] = 1.0,
+        keyword: bool = False,
+        stt_delay: float = 0.,
+        gap_seconds: float = 1.0,
+        output: Optional[str] = None,
+        **kwargs
+    ) -> Dict[str, object]:
+    """replay playlist into a fresh automaton and time its turns; kwargs go to the automaton"""
+    session = ReplaySession(playlist, speed=speed, gap_seconds=gap_seconds)
+    stt = LocalSTT(session, delay=stt_delay)
+    module, name = factory.split(":")
+    debug = automaton.DEBUG
+    # DEBUG = 0 switches listen to the keyword model path
+    automaton.DEBUG = 0 if keyword else debug
+    try:
+        with fake_audio_tools(speed=speed or 1.), TurnRecorder(session, stt) as recorder:
+            vca = getattr(importlib.import_module(module), name)(capture=session, stt=stt, **kwargs)
+            recorder.wrap_recognizer(vca.R)
+            try:
+                vca.run()
+            except ReplayFinished:
+                pass
+    finally:
+        automaton.DEBUG = debug
+        session.stop()
+
+    summary = recorder.summary()
+    for stage, stats in summary.items():
+        print(f"{stage:>10}: p50 {stats['p50'] * 1000:8.1f} ms  p95 {stats['p95'] * 1000:8.1f} ms  ({stats['count']} turns)")
+    report = {
+        "automaton": factory,
+        "speed": speed,
+        "keyword": keyword,
+        "stt_delay": stt_delay,
+        "files": len(session.paths),
+        "audio_seconds": session.duration,
+        "host": platform.node(),
+        "machine": platform.machine(),
+        "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+        "summary": summary,
+        "turns": recorder.turns,
+    }
+    if output is not None:
+        with open(output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Wrote turn latencies to {output}")
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end turn latency benchmark on replayed audio")
+    parser.add_argument("paths", nargs="*", help="WAV files to replay, in order; "
+        "default: hey_hal followed by another keyword, from data/hal_keywords")
+    parser.add_argument("--automaton", default="hal9k:Hal9k", help="module:Class to build")
+    parser.add_argument("--speed", type=float, default=1.0, help="replay speed, 0 for as fast as it is read")
+    parser.add_argument("--keyword", action="store_true", help="listen through the keyword model (DEBUG = 0)")
+    parser.add_argument("--kw-model", default=None, help="keyword model artifact, default: the automaton's")
+    parser.add_argument("--stt-delay", type=float, default=0., help="simulated speech to text round trip, seconds")
+    parser.add_argument("--gap", type=float, default=1.0, help="seconds of silence after every file")
+    parser.add_argument("--turns", type=int, default=10, help="turns in the default playlist")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=None, help="JSON report path")
+    args = parser.parse_args()
+
+    paths = args.paths
+    if not paths:
+        rng = random.Random(args.seed)
+        wake = sorted(glob.glob("data/hal_keywords/hey_hal/*.wav"))
+        commands = sorted(glob.glob("data/hal_keywords/options/*.wav"))
+        for _ in range(args.turns):
+            paths += [rng.choice(wake), rng.choice(commands)]
+    kwargs = {}
+    if args.kw_model is not None:
+        kwargs.update(kw_model_path=args.kw_model, kw_model_int8_path=None)
+    run(paths, args.automaton, args.speed or None, args.keyword, args.stt_delay, args.gap, args.output, **kwargs)
+
+
+if __name__ == "__main__":
+    main()